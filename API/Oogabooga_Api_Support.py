@@ -12,6 +12,9 @@ import sseclient
 import main
 import utils.cane_lib
 import utils.based_rag
+import utils.history_journal
+import utils.history_segments
+import utils.history_sqlite
 import utils.logging
 from dotenv import load_dotenv
 import utils.settings
@@ -45,6 +48,9 @@ history_loaded = False
 
 ooga_history = [ ["Hello, I am back!", "Welcome back! *smiles*"] ]
 
+# Held while old pairs get rolled out of the history, so anyone copying it sees it either before or after
+history_rollover_lock = threading.Lock()
+
 headers = {
     "Content-Type": "application/json"
 }
@@ -99,12 +105,6 @@ def run(user_input, temp_level):
     currently_streaming_message = ""
     last_message_streamed = False
 
-    # Load the history from JSON, to clean up the quotation marks
-    #
-    with open("LiveLog.json", 'r') as openfile:
-        ooga_history = json.load(openfile)
-
-
     # Determine what preset we want to load in with
 
     preset = 'Z-Waif-ADEF-Standard'
@@ -216,7 +216,7 @@ def run(user_input, temp_level):
         log_user_input = "{0}".format(user_input)
         log_received_message = "{0}".format(received_message)
 
-        ooga_history.append([log_user_input, log_received_message, utils.tag_task_controller.apply_tags(), "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+        history_append([log_user_input, log_received_message, utils.tag_task_controller.apply_tags(), "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
         # Run a pruning of the deletables
         prune_deletables()
@@ -259,12 +259,6 @@ def run_streaming(user_input, temp_level):
     currently_streaming_message = ""
     last_message_streamed = True
 
-    # Load the history from JSON, to clean up the quotation marks
-    #
-    with open("LiveLog.json", 'r') as openfile:
-        ooga_history = json.load(openfile)
-
-
     # Determine what preset we want to load in with
 
     preset = 'Z-Waif-ADEF-Standard'
@@ -380,6 +374,7 @@ def run_streaming(user_input, temp_level):
     # Redo it and skip
     if force_skip_streaming:
         force_skip_streaming = False
+        utils.voice.force_cut_voice()
         print("\nSkipping message, redoing!\n")
         utils.logging.update_debug_log("Got an input to regenerate! Re-generating the reply...")
         run_streaming(user_input, 1)
@@ -397,8 +392,8 @@ def run_streaming(user_input, temp_level):
 
         # Speaking
         if not main.live_pipe_no_speak:
-            utils.voice.set_speaking(True)
-            utils.voice.speak_line(sentence_list[-1], refuse_pause=True)
+            utils.voice.queue_line(sentence_list[-1], refuse_pause=True)
+            utils.voice.wait_for_speech()
 
     # Print Newline
     print("\n")
@@ -443,7 +438,7 @@ def run_streaming(user_input, temp_level):
     log_user_input = "{0}".format(user_input)
     log_received_message = "{0}".format(received_message)
 
-    ooga_history.append([log_user_input, log_received_message, utils.tag_task_controller.apply_tags(), "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+    history_append([log_user_input, log_received_message, utils.tag_task_controller.apply_tags(), "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
     # Run a pruning of the deletables
     prune_deletables()
@@ -485,9 +480,9 @@ def streamed_update_handler(chunk, assistant_message):
             utils.vtube_studio.set_emote_string(s_assistant_message)
             utils.vtube_studio.check_emote_string_streaming()
 
+        # Queued for the speech worker, so we keep reading the stream while she talks
         if not main.live_pipe_no_speak:
-            utils.voice.set_speaking(True)
-            utils.voice.speak_line(sentence_list[-2], refuse_pause=True)
+            utils.voice.queue_line(sentence_list[-2], refuse_pause=True)
 
 def set_force_skip_streaming(tf_input):
     global force_skip_streaming
@@ -535,7 +530,7 @@ def next_message_oogabooga():
     print("Generating Replacement Message!")
     cycle_message = ooga_history[-1][0]
     cycle_tag = ooga_history[-1][2]
-    ooga_history.pop()
+    history_pop()
 
     # Save
     save_histories()
@@ -567,7 +562,7 @@ def next_message_oogabooga():
 def undo_message():
     global ooga_history
 
-    ooga_history.pop()
+    history_pop()
 
     # Fix the RAG database
     utils.based_rag.remove_latest_database_message()
@@ -584,10 +579,17 @@ def check_load_past_chat():
 
     if history_loaded == False:
 
-        # Load the history from JSON
+        # Load the history from JSON (plus anything journaled since), and start saving changes behind it
+
+        ooga_history = utils.history_journal.load_history()
 
-        with open("LiveLog.json", 'r') as openfile:
-            ooga_history = json.load(openfile)
+        # In case we went down halfway through rolling pairs out into a segment
+        archived = utils.history_segments.already_archived(ooga_history)
+        if archived > 0:
+            history_trim(archived)
+
+        # And the SQLite copy, if it's on
+        utils.history_sqlite.open_store(ooga_history)
 
         history_loaded = True
 
@@ -595,11 +597,61 @@ def check_load_past_chat():
         utils.based_rag.load_rag_history()
 
 
+# The history in memory is the real one. These change it, and queue the change up to be written out (utils.history_journal)
+def history_append(message_pair):
+    ooga_history.append(message_pair)
+    utils.history_journal.record({'op': "append", 'pair': message_pair})
+    utils.history_sqlite.add_pair(message_pair)
+
+
+def history_pop():
+    ooga_history.pop()
+    utils.history_journal.record({'op': "pop"})
+    utils.history_sqlite.remove_pair(0)
+
+
+def history_delete(index):
+    utils.history_sqlite.remove_pair(len(ooga_history) - 1 - index)
+    del ooga_history[index]
+    utils.history_journal.record({'op': "delete", 'index': index})
+
+    # The RAG points into the history by position, so it needs to know
+    utils.based_rag.live_pair_deleted(index)
+
+
+# Takes pairs off the front, once they're archived (they're still in the SQLite store, that has all of history)
+def history_trim(count):
+    del ooga_history[:count]
+    utils.history_journal.record({'op': "trim", 'count': count})
+
+
+# Moves the oldest pairs out into a Logs/ segment, once the live history gets long enough
+# (a segment at a time, so a long log from before this catches up all at once)
+def history_rollover():
+    count = utils.history_segments.rollover_count(len(ooga_history))
+    while count > 0:
+        with history_rollover_lock:
+            utils.history_segments.archive(ooga_history[:count])
+            history_trim(count)
+
+        count = utils.history_segments.rollover_count(len(ooga_history))
+
+
+# A copy of the live history, and where it starts in all of history (how many pairs are archived before it)
+def history_snapshot():
+    with history_rollover_lock:
+        return utils.history_segments.archived_pair_count(), list(ooga_history)
+
+
 def save_histories():
 
-    # Export to JSON
-    with open("LiveLog.json", 'w') as outfile:
-        json.dump(ooga_history, outfile, indent=4)
+    # Keep the live history from growing forever
+    history_rollover()
+
+    # The chat itself is already being written out behind us, as it changes. This ends the turn, so it all gets synced to
+    # disk together
+    utils.history_journal.commit()
+    utils.history_sqlite.commit()
 
     # Save RAG database too
     utils.based_rag.store_rag_history()
@@ -639,7 +691,7 @@ def soft_reset():
 
     for message_pair in soft_reset_message:
 
-        ooga_history.append([message_pair[0], message_pair[1], utils.settings.cur_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+        history_append([message_pair[0], message_pair[1], utils.settings.cur_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
 
 
@@ -662,7 +714,7 @@ def prune_deletables():
 
     while i < len(ooga_history) - 8:
         if utils.cane_lib.keyword_check(ooga_history[i][0], ["[System D]"]):
-            del ooga_history[i]
+            history_delete(i)
             i = len(ooga_history) - 27
             if i < 0:
                 i = 0
@@ -774,7 +826,7 @@ def summary_memory_run(messages_input, user_sent_message):
         log_user_input = "{0}".format(user_sent_message)
         log_received_message = "{0}".format(received_message)
 
-        ooga_history.append([log_user_input, log_received_message, utils.settings.cur_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+        history_append([log_user_input, log_received_message, utils.settings.cur_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
         # Run a pruning of the deletables
         prune_deletables()
@@ -970,7 +1022,7 @@ def view_image(direct_talk_transcript):
     these_tags = utils.settings.cur_tags.copy()
     these_tags.append("ZW-Visual")
 
-    ooga_history.append([base_send, received_cam_message, these_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+    history_append([base_send, received_cam_message, these_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
 
     # Save
@@ -1122,6 +1174,7 @@ def view_image_streaming(direct_talk_transcript):
         # Redo it and skip
         if force_skip_streaming:
             force_skip_streaming = False
+            utils.voice.force_cut_voice()
             print("\nSkipping message, redoing!\n")
             utils.logging.update_debug_log("Got an input to regenerate! Re-generating the reply...")
             # Just set the message to be small, as this will force a re-run due to our while loop rules
@@ -1139,8 +1192,8 @@ def view_image_streaming(direct_talk_transcript):
 
         # Speaking
         if not main.live_pipe_no_speak:
-            utils.voice.set_speaking(True)
-            utils.voice.speak_line(sentence_list[-1], refuse_pause=True)
+            utils.voice.queue_line(sentence_list[-1], refuse_pause=True)
+            utils.voice.wait_for_speech()
 
     # Print Newline
     print("\n")
@@ -1172,7 +1225,7 @@ def view_image_streaming(direct_talk_transcript):
     these_tags = utils.settings.cur_tags.copy()
     these_tags.append("ZW-Visual")
 
-    ooga_history.append([base_send, received_cam_message, these_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
+    history_append([base_send, received_cam_message, these_tags, "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now())])
 
 
     # Save
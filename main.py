@@ -7,10 +7,11 @@ import emoji
 import utils.audio
 import utils.hotkeys
 import utils.transcriber_translate
+import utils.transcriber_stream
 import utils.voice
 import utils.vtube_studio
 import utils.alarm
-import utils.volume_listener
+import utils.mic_capture
 import utils.minecraft
 import utils.log_conversion
 import utils.cane_lib
@@ -117,7 +118,7 @@ def main_converse():
     try:
         tanscribing_log = "\rYou" + colorama.Fore.GREEN + colorama.Style.BRIGHT + " (mic " + colorama.Fore.BLUE + "[Transcribing (" + str(
             humanize.naturalsize(
-                os.path.getsize(audio_buffer))) + ")]" + colorama.Fore.GREEN + ") " + colorama.Fore.RESET + "> "
+                utils.audio.get_recording_size(audio_buffer))) + ")]" + colorama.Fore.GREEN + ") " + colorama.Fore.RESET + "> "
         print(tanscribing_log, end="", flush=True)
 
         # My own edit- To remove possible transcribing errors
@@ -127,9 +128,11 @@ def main_converse():
         if utils.audio.latest_chat_frame_count < 249 and utils.hotkeys.get_autochat_toggle():
             print("Audio length too small for autochat - cancelling...")
             utils.logging.update_debug_log("Autochat too small in length. Assuming anomaly and not actual speech...")
+            utils.transcriber_stream.cancel_stream()
             return
 
-        transcript = utils.transcriber_translate.to_transcribe_original_language(audio_buffer)
+        # Finishes off the streamed transcript if there is one, or transcribes the whole recording
+        transcript = utils.transcriber_stream.finish_transcription(audio_buffer)
 
 
 
@@ -166,10 +169,7 @@ def main_converse():
     main_message_speak()
 
     # After use, delete the recording.
-    try:
-        os.remove(audio_buffer)
-    except:
-        pass
+    utils.audio.discard_recording(audio_buffer)
 
 
 def main_message_speak():
@@ -190,17 +190,7 @@ def main_message_speak():
 
     s_message = emoji.replace_emoji(message, replace='')
 
-    utils.voice.set_speaking(True)
-
-    voice_speaker = threading.Thread(target=utils.voice.speak_line(s_message, refuse_pause=False))
-    voice_speaker.daemon = True
-    voice_speaker.start()
-
-    # Minirest for frame-piercing (race condition as most people call it) for the speaking
-    time.sleep(0.01)
-
-    while utils.voice.check_if_speaking():
-        time.sleep(0.01)
+    utils.voice.speak_line(s_message, refuse_pause=False)
 
 
 
@@ -570,13 +560,13 @@ def view_image_prompt_get():
     try:
         tanscribing_log = "\rYou" + colorama.Fore.GREEN + colorama.Style.BRIGHT + " (mic " + colorama.Fore.BLUE + "[Transcribing (" + str(
             humanize.naturalsize(
-                os.path.getsize(audio_buffer))) + ")]" + colorama.Fore.GREEN + ") " + colorama.Fore.RESET + "> "
+                utils.audio.get_recording_size(audio_buffer))) + ")]" + colorama.Fore.GREEN + ") " + colorama.Fore.RESET + "> "
         print(tanscribing_log, end="", flush=True)
 
         # My own edit- To remove possible transcribing errors
         transcript = "Whoops! The code is having some issues, chill for a second."
 
-        transcript = utils.transcriber_translate.to_transcribe_original_language(audio_buffer)
+        transcript = utils.transcriber_stream.finish_transcription(audio_buffer)
 
 
 
@@ -720,6 +710,10 @@ def run_program():
     # Load the previous chat history
     API.Oogabooga_Api_Support.check_load_past_chat()
 
+    # Load & warm up the Whisper model in the background, so the first mic turn doesn't have to wait on it
+    whisper_warmup_thread = threading.Thread(target=utils.transcriber_translate.warm_up)
+    whisper_warmup_thread.daemon = True
+    whisper_warmup_thread.start()
 
     # Start the VTube Studio interaction in a separate thread, we ALWAYS do this FYI
     if utils.settings.vtube_enabled:
@@ -740,14 +734,9 @@ def run_program():
         alarm_thread.start()
 
 
-    # Start another thread for the volume levels, and another for the full auto toggle
-    volume_listener = threading.Thread(target=utils.volume_listener.run_volume_listener)
-    volume_listener.daemon = True
-    volume_listener.start()
-
-    volume_listener_toggle = threading.Thread(target=utils.hotkeys.listener_timer)
-    volume_listener_toggle.daemon = True
-    volume_listener_toggle.start()
+    # Start the one shared mic capture, and hook the voice activity detection (for full auto) into it
+    utils.mic_capture.start_capture()
+    utils.hotkeys.start_speech_listener()
 
     chat_recording_buffer = threading.Thread(target=utils.audio.autochat_audio_buffer_record)
     chat_recording_buffer.daemon = True
@@ -0,0 +1,63 @@
+#
+# The RAG scoring engines (utils/rag_scoring.py) have to pick the exact same message as the original full scan did.
+# Run from the main Z-Waif folder with "python -m pytest tests"
+#
+import random
+
+import pytest
+
+import utils.rag_scoring
+
+PAIR_COUNT = 400
+QUERY_COUNT = 300
+VOCABULARY_SIZE = 200
+HISTORY_DEMARC = 20             # Same as based_rag, the latest messages aren't picked from
+
+
+# Word IDs for a fake message. Word use is heavily skewed (like real chat), and IDs 0-3 are the built-in words
+def synthetic_message(rng):
+    return [min(int(rng.paretovariate(0.8)) - 1, VOCABULARY_SIZE - 1) for _ in range(rng.randint(0, 40))]
+
+
+@pytest.mark.parametrize("engine_name", list(utils.rag_scoring.ENGINES))
+def test_engine_matches_full_scan(engine_name):
+    rng = random.Random(1234)
+
+    my_messages = [synthetic_message(rng) for _ in range(PAIR_COUNT)]
+    her_messages = [synthetic_message(rng) for _ in range(PAIR_COUNT)]
+
+    # Word counts, for the common words (undos don't uncount, same as the real RAG)
+    counts = [0] * VOCABULARY_SIZE
+    for word_ids in my_messages + her_messages:
+        for word_id in word_ids:
+            counts[word_id] += 1
+    common_words = utils.rag_scoring.CommonWords(0.00077)
+    common_words.rebuild(counts, sum(counts))
+
+    engine = utils.rag_scoring.create_engine(engine_name)
+    engine.build(my_messages, her_messages)
+
+    for query in range(QUERY_COUNT):
+
+        # Now and then, undo the latest message or add a new one, like a real chat would
+        if query % 10 == 3:
+            my_messages.pop()
+            her_messages.pop()
+            engine.remove_latest()
+        elif query % 10 == 7:
+            my_messages.append(synthetic_message(rng))
+            her_messages.append(synthetic_message(rng))
+            for word_id in my_messages[-1] + her_messages[-1]:
+                counts[word_id] += 1
+            common_words.update(counts, sum(counts), my_messages[-1] + her_messages[-1])
+            engine.add_message(my_messages[-1], her_messages[-1])
+
+        # Six keywords, padded out with word 0 when there weren't enough good ones (same as run_based_rag does)
+        keyword_ids = [rng.randrange(VOCABULARY_SIZE) for _ in range(rng.randint(0, 6))]
+        keyword_ids += [0] * (6 - len(keyword_ids))
+
+        last_id = len(my_messages) - HISTORY_DEMARC - 1
+        expected = utils.rag_scoring.full_scan_best_message(keyword_ids, my_messages, her_messages, 1, last_id, common_words.bitmap)
+
+        assert engine.best_message(keyword_ids, 1, last_id, common_words.bitmap) == expected, "keywords " + str(keyword_ids)
+        assert engine.message_count() == len(my_messages)
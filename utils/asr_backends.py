@@ -0,0 +1,101 @@
+#
+# Speech recognition backends. Each one loads a model and turns 16kHz float32 audio (or a file path) into text segments.
+# Pick one with WHISPER_BACKEND in the .env; the heavy imports only happen for the one that actually gets loaded.
+#
+#   "whisper"         - OpenAI Whisper on torch. The original, uses the GPU if there is one (fp32 on CPU)
+#   "faster-whisper"  - CTranslate2 (faster-whisper), int8 quantized on CPU / fp16 on GPU. Much faster on CPU-only machines
+#
+import numpy as np
+
+# Whisper (and every backend here) works on 16kHz mono float32 audio
+SAMPLE_RATE = 16000
+
+
+class WhisperBackend:
+
+    name = "whisper"
+
+    def __init__(self, model_name):
+        import torch
+
+        self.model_name = model_name
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.compute_type = "fp16" if self.device == "cuda" else "fp32"
+        self.model = None
+
+    def load(self):
+        import whisper
+
+        self.model = whisper.load_model(self.model_name, device=self.device)
+
+    def transcribe(self, audio, language="en"):
+        result = self.model.transcribe(audio, language=language, compression_ratio_threshold=1.9, no_speech_threshold=0.1,
+                                       fp16=(self.device == "cuda"))
+
+        return [segment['text'] for segment in result["segments"]]
+
+    def unload(self):
+        self.model = None
+
+        if self.device == "cuda":
+            import torch
+            torch.cuda.empty_cache()
+
+
+class FasterWhisperBackend:
+
+    name = "faster-whisper"
+
+    def __init__(self, model_name):
+        import ctranslate2
+
+        self.model_name = model_name
+        self.device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        self.compute_type = "float16" if self.device == "cuda" else "int8"
+        self.model = None
+
+    def load(self):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(self.model_name, device=self.device, compute_type=self.compute_type)
+
+    def transcribe(self, audio, language="en"):
+        segments, info = self.model.transcribe(audio, language=language, compression_ratio_threshold=1.9, no_speech_threshold=0.1)
+
+        # Segments come out of a generator, the decoding actually happens as we go through them
+        return [segment.text for segment in segments]
+
+    def unload(self):
+        self.model = None
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(backend_name, model_name):
+    backend_name = str(backend_name).strip().lower()
+
+    if backend_name not in BACKENDS:
+        print("Unknown Whisper backend '" + backend_name + "', using '" + WhisperBackend.name + "' instead!")
+        backend_name = WhisperBackend.name
+
+    return BACKENDS[backend_name](model_name)
+
+
+# Converts raw 16-bit PCM into the 16kHz mono float32 array the backends want, resampling once if needed
+def pcm16_to_float32(data, rate, channels=1):
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+
+    if channels > 1:
+        samples = samples[:len(samples) - (len(samples) % channels)].reshape(-1, channels).mean(axis=1)
+
+    if rate == SAMPLE_RATE or len(samples) == 0:
+        return samples
+
+    # Linear resample, plenty for speech recognition
+    target_length = int(len(samples) * SAMPLE_RATE / rate)
+    source_points = np.arange(target_length, dtype=np.float64) * (rate / SAMPLE_RATE)
+    return np.interp(source_points, np.arange(len(samples)), samples).astype(np.float32)
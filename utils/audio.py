@@ -1,4 +1,6 @@
+import queue
 import time
+import threading
 
 import pyaudio
 import wave
@@ -8,27 +10,149 @@ import utils.hotkeys
 import os, audioop
 
 import sounddevice as sd
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
 
-import utils.volume_listener
+import utils.mic_capture
+import utils.transcriber_stream
+import utils.asr_backends
 
-CHUNK = 1024
+CHUNK = utils.mic_capture.CHUNK
 
 FORMAT = pyaudio.paInt16
 
 CHANNELS = 1
 
-RATE = 44100
+RATE = utils.mic_capture.RATE
 
 current_directory = os.path.dirname(os.path.abspath(__file__))
 FILENAME = "voice.wav"
 SAVE_PATH = os.path.join(current_directory, "resource", "voice_in", FILENAME)
 
-chat_buffer_frames = []
+# Keep recordings in memory and hand them straight to Whisper, instead of going through a WAV file (and ffmpeg)
+RECORD_TO_MEMORY = os.environ.get("RECORD_TO_MEMORY") == "ON"
+
+# Autochat pre-roll, the ~1-2 seconds from before you started talking. One fixed circular buffer, written in place
+PREROLL_CHUNKS = 74
+PREROLL_SIZE = PREROLL_CHUNKS * CHUNK * 2
+preroll_buffer = bytearray(PREROLL_SIZE)
+preroll_written = 0         # Bytes written since the last clear
+preroll_lock = threading.Lock()
 
 latest_chat_frame_count = 0
 
 
 
+# Playback. One PyAudio, and one output stream per format that stays open, fed by a worker thread from a queue of clips.
+# Clips go out back-to-back without reopening anything, and we walk the audio with memoryview slices instead of copying it
+PLAYBACK_CHUNK = 1024           # Frames per write
+playback_pyaudio = None
+output_streams = {}             # (sample width, channels, rate) -> open output stream
+playback_queue = queue.Queue()
+playback_thread = None
+playback_lock = threading.Lock()
+playback_generation = 0         # Bumped by stop_playback(), anything queued before that gets dropped
+
+
+def get_output_stream(sample_width, channels, rate):
+    global playback_pyaudio
+
+    key = (sample_width, channels, rate)
+    if key not in output_streams:
+        if playback_pyaudio is None:
+            playback_pyaudio = pyaudio.PyAudio()
+
+        output_streams[key] = playback_pyaudio.open(format=playback_pyaudio.get_format_from_width(sample_width),
+                                                    channels=channels,
+                                                    rate=rate,
+                                                    output=True)
+
+    return output_streams[key]
+
+
+def start_playback_worker():
+    global playback_thread
+
+    with playback_lock:
+        if playback_thread is None:
+            playback_thread = threading.Thread(target=playback_worker)
+            playback_thread.daemon = True
+            playback_thread.start()
+
+
+def playback_worker():
+    while True:
+        clip = playback_queue.get()
+
+        try:
+            write_clip(*clip[:6])
+        except Exception as e:
+            print("Issue playing audio: " + str(e))
+        finally:
+            clip[6].set()
+
+
+def write_clip(data, sample_width, channels, rate, audio_level_callback, generation):
+    stream = get_output_stream(sample_width, channels, rate)
+
+    # PyAudio only takes read-only buffers, so something like a bytearray gets copied once here (and never again)
+    view = memoryview(data).cast('B')
+    if not view.readonly:
+        view = memoryview(bytes(view))
+
+    step = PLAYBACK_CHUNK * sample_width * channels
+
+    for offset in range(0, len(view), step):
+        if generation != playback_generation:
+            return
+
+        chunk = view[offset:offset + step]
+        stream.write(chunk)
+
+        if audio_level_callback is not None:
+            audio_level_callback(get_rms(chunk, sample_width))
+
+
+# RMS of a chunk, in the same units as audioop.rms
+def get_rms(chunk, sample_width):
+    if sample_width == 2:
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        if len(samples) == 0:
+            return 0
+        return int(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+
+    return audioop.rms(chunk, sample_width)
+
+
+# Puts raw PCM on the end of the playback queue. Gives back an event that gets set once the clip is done playing
+def queue_pcm(data, sample_width, channels, rate, audio_level_callback=None):
+    start_playback_worker()
+
+    finished = threading.Event()
+    playback_queue.put((data, sample_width, channels, rate, audio_level_callback, playback_generation, finished))
+    return finished
+
+
+# Plays raw PCM, waiting until it is done (after anything already queued)
+def play_pcm(data, sample_width, channels, rate, audio_level_callback=None):
+    queue_pcm(data, sample_width, channels, rate, audio_level_callback).wait()
+
+
+# Drops anything queued up, and cuts off whatever is playing right now
+def stop_playback():
+    global playback_generation
+
+    playback_generation += 1
+
+    try:
+        while True:
+            clip = playback_queue.get_nowait()
+            clip[6].set()
+    except queue.Empty:
+        pass
+
+
 def play_mp3(path, audio_level_callback=None):
     audio_file = AudioSegment.from_file(path, format="mp3")
     play_mp3_memory(audio_file, audio_level_callback)
@@ -36,55 +160,20 @@ def play_mp3(path, audio_level_callback=None):
 
 # Plays an MP3 file from memory
 def play_mp3_memory(audio_file, audio_level_callback=None):
-    # Initialize PyAudio
-    p = pyaudio.PyAudio()
-
-    # Open a stream to play the audio
-    stream = p.open(format=pyaudio.paInt16,
-                    channels=audio_file.channels,
-                    rate=audio_file.frame_rate,
-                    output=True)
-
-    # Read the audio data in chunks and play it
-    chunk_size = 1024
-    data = audio_file.raw_data
-    while data:
-        chunk = data[:chunk_size]
-        stream.write(chunk)
-        data = data[chunk_size:]
-        if audio_level_callback is not None:
-            volume = audioop.rms(chunk, 2)
-            normalized_volume = (volume / 32767) * 100
-            audio_level_callback(normalized_volume / 14)
+    level_callback = None
+    if audio_level_callback is not None:
+        level_callback = lambda volume: audio_level_callback(((volume / 32767) * 100) / 14)
 
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
+    play_pcm(audio_file.raw_data, audio_file.sample_width, audio_file.channels, audio_file.frame_rate, level_callback)
 
 
 def play_wav_memory(audio_file, audio_level_callback=None):
-    # Initialize PyAudio
-    p = pyaudio.PyAudio()
-
-    # Open a stream to play the audio
-    stream = p.open(format=p.get_format_from_width(audio_file.getsampwidth()),
-                    channels=audio_file.getnchannels(),
-                    rate=audio_file.getframerate(),
-                    output=True)
-
-    # Read the audio data in chunks and play it
-    chunk_size = 1024
-    data = audio_file.readframes(chunk_size)
-    while data:
-        stream.write(data)
-        data = audio_file.readframes(chunk_size)
-        if audio_level_callback is not None:
-            volume = audioop.rms(data, 2)
-            audio_level_callback(volume / 10000)
+    level_callback = None
+    if audio_level_callback is not None:
+        level_callback = lambda volume: audio_level_callback(volume / 10000)
 
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
+    data = audio_file.readframes(audio_file.getnframes())
+    play_pcm(data, audio_file.getsampwidth(), audio_file.getnchannels(), audio_file.getframerate(), level_callback)
 
 
 # Plays wav file
@@ -94,29 +183,60 @@ def play_wav(path, audio_level_callback=None):
 
 
 def record():
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
     frames = []
 
-    # Check for if we want to add our audio buffer
-    global chat_buffer_frames
-    if len(chat_buffer_frames) > 1:
-        frames = chat_buffer_frames.copy()
+    # Check for if we want to add our audio buffer (copied out, the autochat thread keeps writing into it)
+    if preroll_written > CHUNK * 2:
+        frames = preroll_copy()
+
+    # Read from the shared mic capture, starting right now
+    read_position = utils.mic_capture.get_position()
+
+    # Start transcribing while we are still recording, if we are streaming (the pre-roll is the audio right before now)
+    if utils.transcriber_stream.WHISPER_STREAMING:
+        utils.transcriber_stream.start_stream(RATE, read_position - sum(len(frame) for frame in frames) // 2)
+        for frame in frames:
+            utils.transcriber_stream.feed_frames(frame)
+
+    recording = None
+    try:
+        recording = record_frames(frames, read_position)
+    finally:
+        # If recording broke, don't leave the stream's worker running
+        if recording is None:
+            utils.transcriber_stream.cancel_stream(wait=True)
 
+    return recording
+
+
+def record_frames(frames, read_position):
     while utils.hotkeys.get_speak_input():
-        data = stream.read(CHUNK)
+
+        if utils.mic_capture.no_mic:
+            time.sleep(0.01)
+            continue
+
+        # Timeout, so we still notice the toggle going off even if the mic stalls
+        data, read_position = utils.mic_capture.read_chunk(read_position, CHUNK, timeout=0.1)
+        if data is None:
+            continue
+
         frames.append(data)
+        utils.transcriber_stream.feed_frames(data)
 
-    stream.stop_stream()
-    stream.close()
+    # Write out our frame count (in chunks)
+    global latest_chat_frame_count
+    latest_chat_frame_count = sum(len(frame) for frame in frames) // (CHUNK * 2)
 
-    p.terminate()
+    # In-memory mode, no file round-trip at all
+    if RECORD_TO_MEMORY:
+        return frames_to_whisper_array(frames)
 
 
     wf = wave.open(SAVE_PATH, 'wb')
 
     wf.setnchannels(CHANNELS)
-    wf.setsampwidth(p.get_sample_size(FORMAT))
+    wf.setsampwidth(pyaudio.get_sample_size(FORMAT))
     wf.setframerate(RATE)
     wf.writeframes(b''.join(frames))
     wf.close()
@@ -124,41 +244,90 @@ def record():
     # Test out playing the recorded audio (wav file)
     # play_wav(SAVE_PATH)
 
-    # Write out our frame count
-    global latest_chat_frame_count
-    latest_chat_frame_count = len(frames)
-
     return SAVE_PATH
 
-def autochat_audio_buffer_record():
 
-    # Make sure we have an actual audio device, return otherwise
-    if utils.volume_listener.no_mic:
+# Converts raw 16-bit PCM frames into the 16kHz float32 array Whisper wants, resampling once if needed
+def frames_to_whisper_array(frames, rate=RATE):
+    return utils.asr_backends.pcm16_to_float32(b''.join(frames), rate)
+
+
+# Size of a recording, whether it is a file path or an in-memory array
+def get_recording_size(recording):
+    if isinstance(recording, np.ndarray):
+        return recording.nbytes
+
+    return os.path.getsize(recording)
+
+
+# Cleans up after a recording, once it has been transcribed
+def discard_recording(recording):
+    if isinstance(recording, np.ndarray):
         return
 
-    global chat_buffer_frames
+    try:
+        os.remove(recording)
+    except:
+        pass
 
-    # Main recording buffer
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
 
-    while True:
+def preroll_clear():
+    global preroll_written
 
-        # If there is no autochat, or we are actively in the middle of a chat, clear it
-        if utils.hotkeys.get_autochat_toggle() == False:
-            time.sleep(0.002)     # Rest here a bit, no need to hotloop it
-            chat_buffer_frames = []
+    with preroll_lock:
+        preroll_written = 0
+
+
+def preroll_append(samples):
+    global preroll_written
+
+    data = memoryview(samples).cast('B')
+
+    with preroll_lock:
+        start = preroll_written % PREROLL_SIZE
+        end = start + len(data)
+
+        if end <= PREROLL_SIZE:
+            preroll_buffer[start:end] = data
+        else:
+            split = PREROLL_SIZE - start
+            preroll_buffer[start:] = data[:split]
+            preroll_buffer[:end - PREROLL_SIZE] = data[split:]
+
+        preroll_written += len(data)
 
 
-        # If there is autochat, and no active chat, record it
-        elif utils.hotkeys.get_autochat_toggle() == True:
+# The pre-roll, oldest audio first. Copied out while we hold the lock, so the autochat thread can't write over it halfway
+def preroll_copy():
+    with preroll_lock:
+        view = memoryview(preroll_buffer)
 
-            # Record
-            data = stream.read(CHUNK)
-            chat_buffer_frames.append(data)
+        if preroll_written <= PREROLL_SIZE:
+            return [bytes(view[:preroll_written])]
 
-            # Clearing anything over the buffer
-            if len(chat_buffer_frames) > 74:
-                chat_buffer_frames.pop(0)
+        split = preroll_written % PREROLL_SIZE
+        return [bytes(view[split:]), bytes(view[:split])]
 
 
+def autochat_audio_buffer_record():
+
+    # Make sure we have an actual audio device, return otherwise
+    if utils.mic_capture.no_mic:
+        return
+
+    # Reads from the shared mic capture
+    read_position = utils.mic_capture.get_position()
+
+    while True:
+
+        # If there is no autochat, clear it, and sleep until autochat gets turned on
+        if utils.hotkeys.get_autochat_toggle() == False:
+            preroll_clear()
+            utils.hotkeys.AUTOCHAT_EVENT.wait()
+            read_position = utils.mic_capture.get_position()
+            continue
+
+        # If there is autochat, record it (overwriting the oldest audio once it is full)
+        samples, read_position = utils.mic_capture.read_chunk_view(read_position, CHUNK, timeout=0.1)
+        if samples is not None:
+            preroll_append(samples)
@@ -1,12 +1,17 @@
 import API.Oogabooga_Api_Support
-import string
+import array
+import collections
+import multiprocessing
 import threading
 import utils.lorebook
-import random
-import json
 import os
 import time
+import numpy as np
 import utils.custom_logging
+import utils.history_segments
+import utils.rag_scoring
+import utils.rag_store
+import utils.rag_tokenizer
 import utils.settings
 from utils.i18n import get_i18n_manager
 
@@ -14,22 +19,60 @@ from utils.i18n import get_i18n_manager
 i18n = get_i18n_manager()
 _ = i18n.get_text
 
-# Words and their data
+# Words and their data. Counts are a compact array, running in parallel with the word list. Values come straight from
+# the counts (see get_word_value), so they are never out of date
 word_database = {
     'word': ["", " ", "the", "it"],
-    'count': [1, 1, 1, 1],
-    'value': [0.0, 0.0, 0.0, 0.0],
+    'count': array.array('q', [1, 1, 1, 1]),
     'total_word_count': 0
 }
 
+# Word -> word ID, so we never have to scan the word list
+word_index = {"": 0, " ": 1, "the": 2, "it": 3}
+
 # Histories
 histories_word_id_database = {
-    'me': [],
-    'her': [],
-    'scores': []
+    'me': utils.rag_store.MessageWordIDs(),
+    'her': utils.rag_store.MessageWordIDs()
 }
 
-history_database = [["Start of all history!", "Start of all history!"]]
+# The live chat history as it is right now (and where it starts), for the RAG history to point into
+def get_live_history():
+    return API.Oogabooga_Api_Support.history_snapshot()
+
+
+# Every message pair, by where to find it in the chat logs (see utils.rag_store.RagHistory), read back when needed.
+# Gets replaced instead of changed, so views that are already out keep reading the history they were scored on
+history_database = utils.rag_store.RagHistory((0, []))
+
+# Saving. A binary snapshot, plus a log of the changes since then (see utils/rag_store.py)
+RAG_SNAPSHOT_PATH = "RAG_Database/LiveRAG_Snapshot.bin"
+RAG_DELTA_PATH = "RAG_Database/LiveRAG_Delta.jsonl"
+RAG_COMPACT_EVERY = 200         # Changes in the log before we fold them into a new snapshot
+
+rag_snapshot_generation = 0
+rag_delta_count = 0             # Changes in the log right now
+pending_rag_changes = []        # Changes that haven't been saved yet
+rag_snapshot_needed = False     # Set when the whole index changed, so it all gets saved next time
+
+# Rebuilds count the words in a pool of processes, a run of message pairs at a time
+RAG_REBUILD_WORKERS = int(os.environ.get("RAG_REBUILD_WORKERS", "1"))      # 0 is one per CPU core
+RAG_REBUILD_CHUNK = 2000        # Message pairs per run
+
+COMMON_WORD_RATIO = 0.00077     # Words making up more than this much of all words are too common to search on
+
+# Index of which words are in which message pairs, for scoring. "postings" or "numpy", see utils/rag_scoring.py
+rag_engine = utils.rag_scoring.create_engine(os.environ.get("RAG_ENGINE", utils.rag_scoring.PostingsEngine.name))
+
+# Bitmap of the words that are too common to search on. Messages keep all their words, these get left out when scoring
+common_words = utils.rag_scoring.CommonWords(COMMON_WORD_RATIO)
+
+# What the RAG gets scored against. Anything that changes the database (adding, undoing, loading) holds the write lock,
+# and publishes a new view when it is done. Scoring just grabs whichever view is current and never locks, so every chat
+# (Discord, Minecraft, the web UI...) can use the RAG at once. Nothing in a view changes after it is published
+RagView = collections.namedtuple("RagView", ["word_index", "words", "word_count", "counts", "common", "engine", "history"])
+rag_write_lock = threading.RLock()
+rag_view = None
 
 show_rag_debug = True
 show_rag_debug_deep = False
@@ -38,6 +81,12 @@ current_rag_message = _("default_messages.no_memory_currently", "rag")
 
 history_demarc = 20         # This is the point where the history gets considered as usable for RAG
 
+# Windowed mode, pulls the best few runs of messages (by their total score) instead of the 3 around the best single one
+rag_windowed = os.environ.get("RAG_WINDOWED") == "ON"
+rag_window_size = int(os.environ.get("RAG_WINDOW_SIZE", "3"))
+rag_window_count = int(os.environ.get("RAG_WINDOW_COUNT", "2"))
+rag_char_budget = int(os.environ.get("RAG_CHAR_BUDGET", "2400"))
+
 manual_recalculate_ignore_latest = False
 is_setting_up = True
 
@@ -59,89 +108,187 @@ def setup_based_rag():
         print(rag_running_msg)
 
     # Create a word-value database(d)
-    global word_database
     global manual_recalculate_ignore_latest
     global is_setting_up
     global history_database
 
-    #
-    # IMPLEMENT SMART THREADING: Split it per thread and continually grab next order
-    #
+    with rag_write_lock:
 
-    #
-    # HISTORY LOGS
-    #
+        # Start from nothing, so running this again doesn't count everything twice
+        reset_rag_database()
+        history_database = utils.rag_store.RagHistory(get_live_history())
 
-    for file in os.listdir("Logs/"):
-        if file.endswith(".json") and file.startswith("ChatLog"):
-            with open("Logs/" + file, 'r') as openfile:
-                temp_hist = json.load(openfile)
-                history_database += temp_hist
+        #
+        # HISTORY LOGS
+        #
 
-        else:
-            continue
+        # Imported / converted logs first, then all of our own history (the segments rolled out of the live log, then
+        # the live log itself). Only where each message is gets kept, not the text
+        for file in utils.history_segments.imported_log_files():
+            history_database.add_import(file, len(utils.history_segments.read_log(file)))
 
+        history_database.add_own(0, history_database.live_start + len(history_database.live))
 
-    # Import Current History As Well
-    history_database += API.Oogabooga_Api_Support.ooga_history
 
+        #
+        # LIVE HISTORY
+        #
 
-    #
-    # LIVE HISTORY
-    #
+        # Count all uses of every word, split up over all of our cores
+        count_history_words(history_log_chunks())
 
-    # Main loop that will run through and count all uses of a given word
-    # Thread this as well eventually
-    i = 0
-    while i < len(history_database):
 
-        # Add in each message pair
-        parse_words_to_database(history_database[i][0], 0)
-        parse_words_to_database(history_database[i][1], 1)
+        # Index which messages have which words (and which words are common), for searching
+        rebuild_rag_engine()
 
-        i = i + 1
+        # All new, so save it all next time
+        global rag_snapshot_needed
+        rag_snapshot_needed = True
+
+        # Flag us so we don't add latest message in
+        manual_recalculate_ignore_latest = True
 
 
+        # Flag this as done
+        is_setting_up = False
 
-    # Calculate the values of all words
-    # Thread this as well eventually
+        publish_rag_view()
 
-    calc_word_values()
 
+        # Print out so we can see if the word database is working
+        if show_rag_debug_deep:
+            utils.custom_logging.update_rag_log(word_database)
+            utils.custom_logging.update_rag_log(histories_word_id_database)
 
 
-    # Clear out any common words from the database index, for searching purposes
-    # Thread this as well eventually
-    i = 0
-    while i < len(histories_word_id_database["me"]):
-        prune_common(i)
-        i = i + 1
 
 
-    # Flag us so we don't add latest message in
-    manual_recalculate_ignore_latest = True
+# Empties out the word database (the history is left alone)
+def reset_rag_database():
+    global word_database, word_index, histories_word_id_database
 
+    word_database = {
+        'word': ["", " ", "the", "it"],
+        'count': array.array('q', [1, 1, 1, 1]),
+        'total_word_count': 0
+    }
+    word_index = {"": 0, " ": 1, "the": 2, "it": 3}
 
-    # Flag this as done
-    is_setting_up = False
+    histories_word_id_database = {
+        'me': utils.rag_store.MessageWordIDs(),
+        'her': utils.rag_store.MessageWordIDs()
+    }
 
 
-    # Print out so we can see if the word database is working
-    if show_rag_debug_deep:
-        utils.custom_logging.update_rag_log(word_database)
-        utils.custom_logging.update_rag_log(histories_word_id_database)
+# The whole history, a run of message pairs at a time, read straight out of the logs in the same order setup_based_rag
+# lays them out in
+def history_log_chunks():
+    yield [utils.rag_store.START_PAIR]
 
+    for file, count in history_database.imports:
+        message_pairs = utils.history_segments.read_log(file)
+        for i in range(0, len(message_pairs), RAG_REBUILD_CHUNK):
+            yield message_pairs[i:i + RAG_REBUILD_CHUNK]
 
+    for segment_pairs in utils.history_segments.iter_segment_pairs():
+        yield segment_pairs
 
+    live_history = history_database.live
+    for i in range(0, len(live_history), RAG_REBUILD_CHUNK):
+        yield live_history[i:i + RAG_REBUILD_CHUNK]
 
-def run_based_rag(message, her_previous):
 
-    global word_database
+# Counts the words in the whole history (given as runs of message pairs), spread over a process pool. The runs get
+# merged back in order, so the word IDs come out exactly the same as going through it all one message at a time
+def count_history_words(chunks):
+    global histories_word_id_database
+
+    workers = min(RAG_REBUILD_WORKERS or os.cpu_count() or 1, len(history_database) // RAG_REBUILD_CHUNK + 1)
+
+    # Workers are forked off of us. Anywhere that can't fork (Windows, Mac) would start each one fresh, re-importing
+    # main.py and with it the whole app (the UI, camera, Discord...), so those just count it all in here
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        utils.custom_logging.update_debug_log("RAG rebuild can't fork workers here, counting in this process instead.")
+        workers = 1
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context("fork").Pool(workers)
+        counted_chunks = pool.imap(utils.rag_tokenizer.count_message_pairs, chunks)
+    else:
+        counted_chunks = map(utils.rag_tokenizer.count_message_pairs, chunks)
+
+    word_ids = {'me': ([], [np.zeros(1, dtype=np.int64)]), 'her': ([], [np.zeros(1, dtype=np.int64)])}
+    start_time = time.time()
+    pairs_done = 0
+
+    try:
+        for counted_chunk in counted_chunks:
+            merge_counted_chunk(counted_chunk, word_ids)
+
+            pairs_done += len(counted_chunk[3]) - 1
+            eta = (time.time() - start_time) / pairs_done * (len(history_database) - pairs_done)
+            if show_rag_debug:
+                utils.custom_logging.update_rag_log(_("rag_system.rebuild_progress", "rag", done=pairs_done,
+                                                      total=len(history_database), eta=round(eta, 1)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for side in ('me', 'her'):
+        flat_ids, offsets = word_ids[side]
+        histories_word_id_database[side] = utils.rag_store.MessageWordIDs(np.concatenate(flat_ids or [np.zeros(0, dtype=np.uint32)]).astype(np.uint32),
+                                                                          np.concatenate(offsets))
+
+
+# Adds one counted run (from utils.rag_tokenizer.count_message_pairs) onto the word database
+def merge_counted_chunk(counted_chunk, word_ids):
+    words, counts, my_ids, my_offsets, her_ids, her_offsets, total_word_count = counted_chunk
+
+    # Local word IDs -> real ones, adding in any words we haven't seen yet (in the order they showed up)
+    id_map = np.empty(len(words), dtype=np.uint32)
+    for local_id, word in enumerate(words):
+        word_id = word_index.get(word)
+        if word_id is None:
+            word_id = word_index[word] = len(word_database['word'])
+            word_database['word'].append(word)
+            word_database['count'].append(0)
+        id_map[local_id] = word_id
+
+    word_counts = np.frombuffer(word_database['count'], dtype=np.int64)
+    word_counts[id_map] += counts
+    del word_counts             # Let go of the array, so it can grow again
+
+    word_database['total_word_count'] += total_word_count
+
+    for side, side_ids, side_offsets in (('me', my_ids, my_offsets), ('her', her_ids, her_offsets)):
+        flat_ids, offsets = word_ids[side]
+        flat_ids.append(id_map[side_ids])
+        offsets.append(side_offsets[1:] + offsets[-1][-1])
+
+
+# Publishes the database as it is right now, for scoring against. The counts get copied, everything else is either
+# only ever added onto (the word list) or gets replaced instead of changed (the history, common word bitmap, engine view)
+def publish_rag_view():
+    global rag_view
+
+    rag_view = RagView(word_index, word_database['word'], len(word_database['word']),
+                       np.frombuffer(word_database['count'], dtype=np.int64).copy(), common_words.bitmap, rag_engine.view(),
+                       history_database)
+
+
+def run_based_rag(message, her_previous):
 
     # Blocking statement to stop if our RAG is not enabled
     if not utils.settings.rag_enabled:
         return
 
+    # Score against the database as it is right now, other chats can keep adding to it meanwhile
+    rag = rag_view
+    if rag is None:
+        return
+
     # Clear the log, a new operation is beginning
     utils.custom_logging.clear_rag_log()
 
@@ -150,27 +297,19 @@ def run_based_rag(message, her_previous):
     #
 
     # Parse the message being sent
-    history_word_ids = parse_words_to_database(message, 2)
+    history_word_ids = lookup_word_ids(rag, message)
     history_word_scores = []
 
 
-    # Check the score value of all words
-    # NOTE: This is a maintenance item that doesn't need to run every time, so we just do it randomly
-
-    random_recalc = random.randint(0, 100)
-    if random_recalc > 70:
-        calc_word_values()
-
-
     # Run evaluation now that we have all of the words
     i = 0
     while i < len(history_word_ids):
 
         # Pair all word keys with scores
-        score = word_database['value'][history_word_ids[i]]
+        score = get_word_value(rag, history_word_ids[i])
 
         # Boost lore word score (only single word)
-        if utils.lorebook.rag_word_check(word_database['word'][history_word_ids[i]]):
+        if utils.lorebook.rag_word_check(rag.words[history_word_ids[i]]):
             score = (score + 1) / 2
 
         history_word_scores.append(score)
@@ -185,7 +324,7 @@ def run_based_rag(message, her_previous):
     # EVALUATE HER SENT ONES SECOND
     #
 
-    hers_history_word_ids = parse_words_to_database(her_previous, 3)
+    hers_history_word_ids = lookup_word_ids(rag, her_previous)
 
 
     # Run evaluation now that we have all of the words
@@ -194,10 +333,10 @@ def run_based_rag(message, her_previous):
     while i < len(hers_history_word_ids):
 
         # Pair all word keys with scores
-        score = word_database['value'][hers_history_word_ids[i]]
+        score = get_word_value(rag, hers_history_word_ids[i])
 
         # Boost lore word score (only single word)
-        if utils.lorebook.rag_word_check(word_database['word'][hers_history_word_ids[i]]):
+        if utils.lorebook.rag_word_check(rag.words[hers_history_word_ids[i]]):
             score = (score + 1) / 2
 
         history_word_ids.append(hers_history_word_ids[i])
@@ -251,7 +390,7 @@ def run_based_rag(message, her_previous):
         x = 0
         log_output_text = ""
         while x < len(highest_score_ids):
-            log_output_text += str(word_database['word'][highest_score_ids[x]]) + "\n"
+            log_output_text += str(rag.words[highest_score_ids[x]]) + "\n"
             x = x + 1
 
         utils.custom_logging.update_rag_log(log_output_text)
@@ -262,33 +401,21 @@ def run_based_rag(message, her_previous):
     #
 
 
-    # Evaluate
-    i = 0
-    while i < len(histories_word_id_database['me']):
-        score_value = evaluate_message(highest_score_ids, histories_word_id_database['me'][i]) + evaluate_message(highest_score_ids, histories_word_id_database['her'][i])
-        histories_word_id_database['scores'][i] = score_value
-        i = i + 1
+    # Find the best message. Disallow message 1 (always start on message 2 or higher), and any recalling from past the
+    # demarc. Should be able to recall / flow from there. More recent entries win ties
+    last_allowed_id = rag.engine.message_count() - history_demarc - 1
 
+    # Windowed, can see from the one before the first allowed message, to the one after the last
+    if rag_windowed and last_allowed_id >= 1:
+        window_starts = utils.rag_scoring.best_windows(rag.engine.message_scores(highest_score_ids, rag.common), 0, last_allowed_id + 1,
+                                                       rag_window_size, rag_window_count,
+                                                       lambda start: get_window_chars(rag.history, start), rag_char_budget)
+        create_windowed_rag_message(rag.history, window_starts)
+        return
 
-    # Print us out the best score & message
-
-    i = 1                       # Disallow message 1; always start on message 2 or higher
-    best_message_score = 0
     best_message_id = 0
-
-    # Disallow any recalling from past the demarc. Should be able to recall / flow from there
-    while i < len(histories_word_id_database['me']) - history_demarc:
-
-        central_score = histories_word_id_database['scores'][i-1]
-        central_score += histories_word_id_database['scores'][i]
-        central_score += histories_word_id_database['scores'][i+1]
-
-        # Less than or equal to makes it so that more recent entries are given a bigger score
-        if best_message_score <= histories_word_id_database['scores'][i]:
-            best_message_id = i
-            best_message_score = histories_word_id_database['scores'][i]
-
-        i = i + 1
+    if last_allowed_id >= 1:
+        best_message_id = rag.engine.best_message(highest_score_ids, 1, last_allowed_id, rag.common)
 
 
     #
@@ -302,12 +429,12 @@ def run_based_rag(message, her_previous):
     user_label = _("rag_system.user_label", "rag")
     
     current_rag_message = f"[System M]; {memory_intro}\n"
-    current_rag_message += f"{user_label}: " + history_database[best_message_id - 1][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id - 1][1] + "\n"
-    current_rag_message += f"{user_label}: " + history_database[best_message_id][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id][1] + "\n"
-    current_rag_message += f"{user_label}: " + history_database[best_message_id + 1][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id + 1][1] + "\n"
+    current_rag_message += f"{user_label}: " + rag.history[best_message_id - 1][0] + "\n"
+    current_rag_message += char_name + ": " + rag.history[best_message_id - 1][1] + "\n"
+    current_rag_message += f"{user_label}: " + rag.history[best_message_id][0] + "\n"
+    current_rag_message += char_name + ": " + rag.history[best_message_id][1] + "\n"
+    current_rag_message += f"{user_label}: " + rag.history[best_message_id + 1][0] + "\n"
+    current_rag_message += char_name + ": " + rag.history[best_message_id + 1][1] + "\n"
     current_rag_message += f"[System M]; {memory_outro}"
 
     if show_rag_debug:
@@ -315,95 +442,93 @@ def run_based_rag(message, her_previous):
 
 
 
-# Bit to actually receive what the RAG has to offer
-def call_rag_message():
-    return current_rag_message
+# Size of a window of messages, in characters
+def get_window_chars(history, start):
+    chars = 0
+    for message_pair in history[start:start + rag_window_size]:
+        chars += len(message_pair[0]) + len(message_pair[1])
 
+    return chars
 
 
-def parse_words_to_database(message, flag):
-
-    global word_database
+def create_windowed_rag_message(history, window_starts):
+    global current_rag_message
 
-    # Count, using a word collector to detect when spaces are gone
-    i = 0
-    word_collector = ""
-    word_start_marker = 0
-    history_word_ids = []
+    memory_intro = _("rag_system.memory_intro", "rag")
+    memory_outro = _("rag_system.memory_outro", "rag")
+    user_label = _("rag_system.user_label", "rag")
 
+    current_rag_message = f"[System M]; {memory_intro}\n"
 
-    # Decide if we want to add to the count, depending on the flag
-    count_to_total = True
+    for window_start in window_starts:
+        for message_pair in history[window_start:window_start + rag_window_size]:
+            current_rag_message += f"{user_label}: " + message_pair[0] + "\n"
+            current_rag_message += char_name + ": " + message_pair[1] + "\n"
 
-    if flag == 2 or flag == 3:
-        count_to_total = False
+        # Space out separate memories
+        if window_start != window_starts[-1]:
+            current_rag_message += "\n"
 
+    current_rag_message += f"[System M]; {memory_outro}"
 
+    if show_rag_debug:
+        utils.custom_logging.update_rag_log(current_rag_message)
 
-    refined_message = message.translate(str.maketrans('', '', string.punctuation))
-    refined_message = str.lower(refined_message)
-    refined_message = refined_message.replace("\n", " ")
 
-    if show_rag_debug_deep:
-        utils.custom_logging.update_rag_log(refined_message)
+# Bit to actually receive what the RAG has to offer
+def call_rag_message():
+    return current_rag_message
 
 
-    while i < len(refined_message):
 
-        if refined_message[i] == " ":
-            word_start_marker = i + 1
+def parse_words_to_database(message, flag):
 
-        # Look for stopping, either spaces or end of message
-        if i + 1 == len(refined_message) or refined_message[i+1] == ' ':
+    global word_database
 
-            # Feed our word collector the marked version
-            word_collector = refined_message[word_start_marker:i+1]
+    history_word_ids = []
 
-            j = 0
-            word_found = False
 
-            # Scan if word is in database
-            while j < len(word_database["word"]):
-                if word_collector == word_database["word"][j]:
+    # Decide if we want to add to the count, depending on the flag
+    count_to_total = True
 
-                    if count_to_total:
-                        word_database["count"][j] = word_database["count"][j] + 1
+    if flag == 2 or flag == 3:
+        count_to_total = False
 
-                    word_found = True
 
-                    # Add to our history word ID database
-                    history_word_ids.append(j)
+    words = utils.rag_tokenizer.cached_tokenize(message)
 
-                j = j + 1
+    if show_rag_debug_deep:
+        utils.custom_logging.update_rag_log(" ".join(words))
 
 
-            # If word not in database and we are counting, add it in (word will simply be skipped for eval parsing)
-            if not word_found and count_to_total:
-                word_database["word"].append(word_collector)
-                word_database["count"].append(1)
-                word_database["value"].append(0.99)         # Note: will have to be recalculated later on for new words
+    for word in words:
 
-                # Add to our history word ID database
-                history_word_ids.append(len(word_database["word"]) - 1)
+        # Look the word up in the database
+        word_id = word_index.get(word)
 
+        if word_id is not None:
 
-            # Set the marker for our next word
-            word_start_marker = i + 2
+            if count_to_total:
+                word_database["count"][word_id] += 1
 
-            # Boost again to skip space
-            i = i + 1
+            # Add to our history word ID database
+            history_word_ids.append(word_id)
 
 
-            # Clear the word
-            word_collector = ""
+        # If word not in database and we are counting, add it in (word will simply be skipped for eval parsing)
+        elif count_to_total:
+            word_index[word] = len(word_database["word"])
+            word_database["word"].append(word)
+            word_database["count"].append(1)
 
-            # Boost our total word count
-            if count_to_total:
-                word_database['total_word_count'] = word_database['total_word_count'] + 1
+            # Add to our history word ID database
+            history_word_ids.append(len(word_database["word"]) - 1)
 
 
+        # Boost our total word count
+        if count_to_total:
+            word_database['total_word_count'] = word_database['total_word_count'] + 1
 
-        i = i + 1
 
     # Sent by me, history
     if flag == 0:
@@ -414,7 +539,6 @@ def parse_words_to_database(message, flag):
     # Sent by her, history
     if flag == 1:
         histories_word_id_database["her"].append(history_word_ids)
-        histories_word_id_database["scores"].append(0)              # Just here so we can score later
 
         return history_word_ids     # Not actually used, for error catchcase
 
@@ -429,66 +553,35 @@ def parse_words_to_database(message, flag):
         return history_word_ids
 
 
-# Calculates the value of all words
-def calc_word_values():
-    global word_database
-
-    # Give base values to all the words, with a maximum score being 1
-    i = 0
-    while i < len(word_database["value"]):
-        word_database['value'][i] = (1 / (word_database['count'][i] + 19)) * 20
-        i = i + 1
-
-
+# Word IDs for the words in a message that a view knows about (anything else is skipped). Nothing gets counted
+def lookup_word_ids(rag, message):
+    word_ids = []
+    for word in utils.rag_tokenizer.cached_tokenize(message):
+        word_id = rag.word_index.get(word)
 
-# Prunes really common words, as there is no need to store these
-def prune_common(point):
+        # The word index only ever gets added onto, so skip anything added after the view
+        if word_id is not None and word_id < rag.word_count:
+            word_ids.append(word_id)
 
-    global word_database
-    global histories_word_id_database
+    return word_ids
 
-    # Prunes the common words out of the given phrase
-    i = 0
-    while i < len(histories_word_id_database["me"][point]):
-        word_id = histories_word_id_database["me"][point][i]
-        if (word_database['count'][word_id] / word_database['total_word_count']) > 0.00077:
-            histories_word_id_database["me"][point].pop(i)
-            i = 0
 
-        i = i + 1
+# Value of a word, from how often it has been used. Rarer words are worth more, with a maximum score being 1
+def get_word_value(rag, word_id):
+    return (1 / (int(rag.counts[word_id]) + 19)) * 20
 
-    i = 0
-    while i < len(histories_word_id_database["her"][point]):
-        word_id = histories_word_id_database["her"][point][i]
-        if (word_database['count'][word_id] / word_database['total_word_count']) > 0.00077:
-            histories_word_id_database["her"][point].pop(i)
-            i = 0
-
-        i = i + 1
 
 
-# Totals and returns the value of a given message, when tied to keywords
-def evaluate_message(valued_word_ids, hist_word_ids):
+def rebuild_rag_engine():
+    common_words.rebuild(word_database['count'], word_database['total_word_count'])
+    rag_engine.build(histories_word_id_database['me'], histories_word_id_database['her'])
 
-    i = 0
-    value = 0
 
-    # Compares for each valued word, so it won't ever do repeats
-    while i < len(valued_word_ids):
-        if hist_word_ids.__contains__(valued_word_ids[i]):
-            value = value + 1
-
-        i = i + 1
-
-    # Reduce the value of the statement if it is long, to avoid "fillabustering" (content getting picked via mass)
-    value = value - (len(hist_word_ids) / 120)
-
-    # Never less than 0
-    if value < 0:
-        value = 0
-
-
-    return value
+# Counts up all the words again from the history, and indexes it
+def recount_rag_database():
+    reset_rag_database()
+    count_history_words(history_database.iter_chunks(RAG_REBUILD_CHUNK))
+    rebuild_rag_engine()
 
 
 # Adds messages to the database once it becomes validated (on next message send)
@@ -500,34 +593,50 @@ def add_message_to_database():
 
     # Import History
     history = API.Oogabooga_Api_Support.ooga_history
-    global word_database, manual_recalculate_ignore_latest, history_database
+    global manual_recalculate_ignore_latest
 
-    # Do not add in if we just manually re-calculated, it is already in there
-    if manual_recalculate_ignore_latest:
-        manual_recalculate_ignore_latest = False
-        return
+    with rag_write_lock:
 
-    new_msg = len(history) - 1
+        # Do not add in if we just manually re-calculated, it is already in there
+        if manual_recalculate_ignore_latest:
+            manual_recalculate_ignore_latest = False
+            return
 
-    # Do not add in if the content is the same as the last message (likely bugged / undo)
-    if (history[new_msg][0] + history[new_msg][1]) == (history_database[-1][0] + history_database[-1][1]):
-        utils.custom_logging.update_debug_log("Preventing dupe in RAG!")
-        return
+        new_msg = len(history) - 1
+
+        # Do not add in if the content is the same as the last message (likely bugged / undo)
+        if (history[new_msg][0] + history[new_msg][1]) == (history_database[-1][0] + history_database[-1][1]):
+            utils.custom_logging.update_debug_log("Preventing dupe in RAG!")
+            return
 
 
-    # Ignore any system deletable messages, and just fall back until before it
-    while history[new_msg][0].__contains__("[System D]"):
-        new_msg = new_msg - 1
+        # Ignore any system deletable messages, and just fall back until before it
+        while history[new_msg][0].__contains__("[System D]"):
+            new_msg = new_msg - 1
 
-    # Add latest message pair, to both the word database AND local hist
-    parse_words_to_database(history[new_msg][0], 0)
-    parse_words_to_database(history[new_msg][1], 1)
+        history_ref = utils.history_segments.archived_pair_count() + new_msg
+        add_message_pair(history[new_msg][0], history[new_msg][1], history_ref)
+        pending_rag_changes.append({'op': "add", 'pair': [history[new_msg][0], history[new_msg][1]], 'ref': history_ref})
 
-    history_database += [[history[new_msg][0], history[new_msg][1]]]
+        publish_rag_view()
 
 
-    # Prune these as well (always latest one, may not sync 1:1 to history due to system messages)
-    prune_common(len(histories_word_id_database['me']) - 1)
+def add_message_pair(my_message, her_message, history_ref):
+    global history_database
+
+    # Add latest message pair, to both the word database AND local hist (just where it is in the chat history)
+    parse_words_to_database(my_message, 0)
+    parse_words_to_database(her_message, 1)
+
+    history_database = history_database.appended(history_ref, get_live_history())
+
+
+    # Some words may have just gotten common
+    common_words.update(word_database['count'], word_database['total_word_count'],
+                        histories_word_id_database['me'][-1] + histories_word_id_database['her'][-1])
+
+    # And index it
+    rag_engine.add_message(histories_word_id_database['me'][-1], histories_word_id_database['her'][-1])
 
 
 
@@ -542,29 +651,72 @@ def remove_latest_database_message():
     # NOTE: Does NOT uncount words! This should mostly be fine in the large scale, and we still have manual recalcs that can self right this
     #
 
-    global histories_word_id_database
+    with rag_write_lock:
+        remove_latest_message_pair()
+        pending_rag_changes.append({'op': "pop"})
+
+        publish_rag_view()
+
+
+def remove_latest_message_pair():
+    rag_engine.remove_latest()
 
     histories_word_id_database["me"].pop()
     histories_word_id_database["her"].pop()
-    histories_word_id_database["scores"].pop()
 
 
 
+# A pair got deleted out of the live history (index is where it was in there), so everything after it moved down one
+def live_pair_deleted(index):
+
+    # Blocking statement to stop if our RAG is not enabled
+    if not utils.settings.rag_enabled:
+        return
+
+    global history_database
+
+    with rag_write_lock:
+        history_ref = utils.history_segments.archived_pair_count() + index
+        history_database = history_database.pair_deleted(history_ref, get_live_history())
+        pending_rag_changes.append({'op': "delete", 'ref': history_ref})
+
+        publish_rag_view()
+
+
+
+# Saves just what changed since last time onto the log, or every so often, the whole thing as a new snapshot
 def store_rag_history():
+    global pending_rag_changes, rag_delta_count
 
     # Blocking statement to stop if our RAG is not enabled
     if not utils.settings.rag_enabled:
         return
 
-    # Save, Export to JSON
-    with open("RAG_Database/LiveRAG_Words.json", 'w') as outfile:
-        json.dump(word_database, outfile, indent=4)
+    with rag_write_lock:
+
+        if rag_snapshot_needed or rag_delta_count + len(pending_rag_changes) >= RAG_COMPACT_EVERY:
+            compact_rag_history()
+            return
+
+        if len(pending_rag_changes) == 0:
+            return
 
-    with open("RAG_Database/LiveRAG_HistoryWordID.json", 'w') as outfile:
-        json.dump(histories_word_id_database, outfile, indent=4)
+        utils.rag_store.append_delta_log(RAG_DELTA_PATH, pending_rag_changes)
+        rag_delta_count += len(pending_rag_changes)
+        pending_rag_changes = []
 
-    with open("RAG_Database/LiveRAG_History.json", 'w') as outfile:
-        json.dump(history_database, outfile, indent=4)
+
+# Writes a fresh snapshot, and starts a new (empty) change log on top of it
+def compact_rag_history():
+    global rag_snapshot_generation, rag_delta_count, pending_rag_changes, rag_snapshot_needed
+
+    rag_snapshot_generation += 1
+    utils.rag_store.write_snapshot(RAG_SNAPSHOT_PATH, word_database, histories_word_id_database, history_database, rag_snapshot_generation)
+    utils.rag_store.reset_delta_log(RAG_DELTA_PATH, rag_snapshot_generation)
+
+    rag_delta_count = 0
+    pending_rag_changes = []
+    rag_snapshot_needed = False
 
 
 def load_rag_history():
@@ -573,44 +725,67 @@ def load_rag_history():
     if not utils.settings.rag_enabled:
         return
 
-    global word_database, histories_word_id_database, history_database, is_setting_up
-
-    # Check if we need to load, or generate the RAG
-    path = 'RAG_Database/LiveRAG_Words.json'
-    path2 = 'RAG_Database/LiveRAG_HistoryWordID.json'
-    path3 = 'RAG_Database/LiveRAG_History.json'
+    global is_setting_up
 
-    check_file = os.path.isfile(path)
-    check_file2 = os.path.isfile(path2)
-    check_file3 = os.path.isfile(path3)
+    with rag_write_lock:
 
+        # Binary snapshot, plus the changes since
+        if os.path.isfile(RAG_SNAPSHOT_PATH) and load_rag_snapshot():
+            is_setting_up = False
+            publish_rag_view()
+            return
 
-    # Switch
-    if check_file and check_file2 and check_file3:
+        # Nothing we can use (no save yet, a damaged one, or an older save that kept the text of every message instead of
+        # where it is), so build it all again from the chat logs
+        manual_recalculate_database()
 
-        # File found, load
 
-        if show_rag_debug:
-            loading_msg = _("rag_system.loading_previous", "rag")
-            utils.custom_logging.update_rag_log(f"\n{loading_msg}\n")
+def load_rag_snapshot():
+    global word_database, word_index, histories_word_id_database, history_database
+    global rag_snapshot_generation, rag_delta_count, rag_snapshot_needed
 
-        with open(path, 'r') as openfile:
-            word_database = json.load(openfile)
+    snapshot = utils.rag_store.read_snapshot(RAG_SNAPSHOT_PATH, get_live_history())
+    if snapshot is None or snapshot[2] is None:
+        return False
 
-        with open(path2, 'r') as openfile:
-            histories_word_id_database = json.load(openfile)
+    if show_rag_debug:
+        loading_msg = _("rag_system.loading_previous", "rag")
+        utils.custom_logging.update_rag_log(f"\n{loading_msg}\n")
 
-        with open(path3, 'r') as openfile:
-            history_database = json.load(openfile)
+    word_database, histories_word_id_database, history_database, snapshot_header = snapshot
+    rag_snapshot_generation = snapshot_header['generation']
 
-        # Flag this as done
-        is_setting_up = False
+    # Snapshots that split words up differently get counted up again from the messages
+    if snapshot_header['tokenizer_version'] != utils.rag_tokenizer.TOKENIZER_VERSION:
+        recount_rag_database()
+        rag_snapshot_needed = True
 
     else:
+        word_index = {}
+        for word_id, word in enumerate(word_database['word']):
+            word_index.setdefault(word, word_id)
 
-        # No file, set up
+        rebuild_rag_engine()
 
-        manual_recalculate_database()
+    # Replay everything that happened after the snapshot was taken
+    changes = utils.rag_store.read_delta_log(RAG_DELTA_PATH, rag_snapshot_generation)
+
+    # No log to go on top of (or it was for an older snapshot), so start a fresh one next save
+    if changes is None:
+        changes = []
+        rag_snapshot_needed = True
+
+    for change in changes:
+        if change['op'] == "add":
+            add_message_pair(change['pair'][0], change['pair'][1], change['ref'])
+        elif change['op'] == "pop":
+            remove_latest_message_pair()
+        elif change['op'] == "delete":
+            history_database = history_database.pair_deleted(change['ref'], get_live_history())
+
+    rag_delta_count = len(changes)
+
+    return True
 
 
 def manual_recalculate_database():
@@ -621,16 +796,3 @@ def manual_recalculate_database():
     print(f"\n{recalc_msg}\n")
     utils.custom_logging.update_rag_log(f"\n{recalc_msg}\n")
     setup_based_rag()
-
-
-def word_value_passive_calculation():
-
-    # Passively recalculate word values in the background
-    # NYI - Not yet implemented. Will need to be pretty smart
-
-    while True:
-        time.sleep(120)
-
-        if not is_setting_up:
-            calc_word_values()
-
@@ -0,0 +1,345 @@
+#
+# Benchmarks, run from the main Z-Waif folder:
+#
+#   python -m utils.benchmark asr <folder of .wav files> [model] [backend,backend,...]
+#
+#       Runs every .wav through each speech recognition backend, and reports the load time, latency per file,
+#       real-time factor (decode time / audio length, lower is better) and peak memory use. Every backend runs in its
+#       own process, so the memory readings don't bleed into each other.
+#
+#   python -m utils.benchmark rag-scoring [message pairs] [queries]
+#
+#       Builds a synthetic chat history, and times building each RAG scoring engine, and picking a message for lots of
+#       random keyword sets (with undos and new messages mixed in), against the original full scan. (That they all pick
+#       the same message is checked by tests/test_rag_scoring.py)
+#
+#   python -m utils.benchmark tokenizer [megabytes]
+#
+#       Splits a few megabytes of synthetic chat (English, Italian and Russian) into RAG words, with the current tokenizer
+#       and with the original character-by-character parser, and reports the throughput of each in MB/s.
+#
+#   python -m utils.benchmark history-save [pairs,pairs,...]
+#
+#       Times saving one chat turn with a history of each size (1k, 10k and 100k message pairs by default). Compares the
+#       original full rewrite of LiveLog.json with the journal (one line + fsync per turn), and the journal's compaction
+#       cost spread over the changes it folds in.
+#
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import wave
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import utils.asr_backends
+import utils.history_journal
+import utils.rag_scoring
+import utils.rag_tokenizer
+
+
+def get_peak_rss_mb():
+
+    # Linux / Mac
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return peak / (1024 * 1024)
+        return peak / 1024
+    except ImportError:
+        pass
+
+    # Windows
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return -1
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(path + " is not 16-bit PCM")
+
+        data = wav_file.readframes(wav_file.getnframes())
+        return utils.asr_backends.pcm16_to_float32(data, wav_file.getframerate(), wav_file.getnchannels())
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+# Runs in its own process, one backend at a time
+def run_asr_backend(backend_name, model_name, wav_paths):
+    clips = [load_wav(path) for path in wav_paths]
+
+    backend = utils.asr_backends.create_backend(backend_name, model_name)
+
+    load_start = time.perf_counter()
+    backend.load()
+    load_time = time.perf_counter() - load_start
+
+    # First decode pays for any one-off setup, so report it on its own
+    first_start = time.perf_counter()
+    backend.transcribe(clips[0])
+    first_time = time.perf_counter() - first_start
+
+    latencies = []
+    audio_seconds = 0.0
+    for clip in clips:
+        decode_start = time.perf_counter()
+        backend.transcribe(clip)
+        latencies.append(time.perf_counter() - decode_start)
+        audio_seconds += len(clip) / utils.asr_backends.SAMPLE_RATE
+
+    return {
+        "backend": backend.name + " (" + backend.device + ", " + backend.compute_type + ")",
+        "load": load_time,
+        "first": first_time,
+        "rtf": sum(latencies) / audio_seconds,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+        "rss": get_peak_rss_mb(),
+    }
+
+
+def benchmark_asr(wav_folder, model_name, backend_names):
+    wav_paths = sorted(os.path.join(wav_folder, file) for file in os.listdir(wav_folder) if file.lower().endswith(".wav"))
+    if len(wav_paths) == 0:
+        print("No .wav files found in " + wav_folder)
+        return
+
+    print("Benchmarking " + str(len(wav_paths)) + " recordings with model '" + model_name + "'...\n")
+
+    spawn_context = multiprocessing.get_context("spawn")
+    results = []
+    for backend_name in backend_names:
+        with spawn_context.Pool(1) as pool:
+            try:
+                results.append(pool.apply(run_asr_backend, (backend_name, model_name, wav_paths)))
+            except Exception as e:
+                print("Backend '" + backend_name + "' failed: " + str(e))
+
+    print("{:<36} {:>8} {:>8} {:>7} {:>8} {:>8} {:>8} {:>10}".format(
+        "Backend", "Load s", "First s", "RTF", "p50 s", "p95 s", "Max s", "Peak MB"))
+    for result in results:
+        print("{:<36} {:>8.2f} {:>8.2f} {:>7.3f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.0f}".format(
+            result["backend"], result["load"], result["first"], result["rtf"],
+            result["p50"], result["p95"], result["max"], result["rss"]))
+
+
+# Word IDs for a fake message. Word use is heavily skewed (like real chat), and IDs 0-3 are the built-in words
+def synthetic_message(rng, vocabulary_size):
+    return [min(int(rng.paretovariate(0.8)) - 1, vocabulary_size - 1) for _ in range(rng.randint(0, 40))]
+
+
+def benchmark_rag_scoring(pair_count, query_count, history_demarc=20):
+    rng = random.Random(1234)
+    vocabulary_size = max(100, pair_count // 2)
+
+    my_messages = [synthetic_message(rng, vocabulary_size) for _ in range(pair_count)]
+    her_messages = [synthetic_message(rng, vocabulary_size) for _ in range(pair_count)]
+
+    # Word counts, for the common words (undos don't uncount, same as the real RAG)
+    counts = [0] * vocabulary_size
+    for word_ids in my_messages + her_messages:
+        for word_id in word_ids:
+            counts[word_id] += 1
+    common_words = utils.rag_scoring.CommonWords(0.00077)
+    common_words.rebuild(counts, sum(counts))
+
+    engines = []
+    for engine_name in utils.rag_scoring.ENGINES:
+        engine = utils.rag_scoring.create_engine(engine_name)
+        build_start = time.perf_counter()
+        engine.build(my_messages, her_messages)
+        engines.append((engine, time.perf_counter() - build_start))
+
+    print("Timing " + str(query_count) + " queries over " + str(pair_count) + " message pairs...\n")
+
+    reference_time = 0.0
+    query_times = [0.0 for _ in engines]
+    for query in range(query_count):
+
+        # Now and then, undo the latest message or add a new one, like a real chat would
+        if query % 10 == 3 and len(my_messages) > 1:
+            my_messages.pop()
+            her_messages.pop()
+            for engine, build_time in engines:
+                engine.remove_latest()
+        elif query % 10 == 7:
+            my_messages.append(synthetic_message(rng, vocabulary_size))
+            her_messages.append(synthetic_message(rng, vocabulary_size))
+            for word_id in my_messages[-1] + her_messages[-1]:
+                counts[word_id] += 1
+            common_words.update(counts, sum(counts), my_messages[-1] + her_messages[-1])
+            for engine, build_time in engines:
+                engine.add_message(my_messages[-1], her_messages[-1])
+
+        # Six keywords, padded out with word 0 when there weren't enough good ones (same as run_based_rag does)
+        keyword_ids = [rng.randrange(vocabulary_size) for _ in range(rng.randint(0, 6))]
+        keyword_ids += [0] * (6 - len(keyword_ids))
+
+        last_id = len(my_messages) - history_demarc - 1
+        if last_id < 1:
+            continue
+
+        reference_start = time.perf_counter()
+        utils.rag_scoring.full_scan_best_message(keyword_ids, my_messages, her_messages, 1, last_id, common_words.bitmap)
+        reference_time += time.perf_counter() - reference_start
+
+        for i, (engine, build_time) in enumerate(engines):
+            query_start = time.perf_counter()
+            engine.best_message(keyword_ids, 1, last_id, common_words.bitmap)
+            query_times[i] += time.perf_counter() - query_start
+
+    print("{:<12} {:>10} {:>14}".format("Engine", "Build s", "Per query ms"))
+    print("{:<12} {:>10} {:>14.3f}".format("full scan", "-", reference_time * 1000 / query_count))
+    for i, (engine, build_time) in enumerate(engines):
+        print("{:<12} {:>10.2f} {:>14.3f}".format(engine.name, build_time, query_times[i] * 1000 / query_count))
+
+
+# The original RAG word parser, for comparing against
+def legacy_tokenize(message):
+    refined_message = message.translate(str.maketrans('', '', string.punctuation))
+    refined_message = str.lower(refined_message)
+    refined_message = refined_message.replace("\n", " ")
+
+    words = []
+    i = 0
+    word_start_marker = 0
+    while i < len(refined_message):
+
+        if refined_message[i] == " ":
+            word_start_marker = i + 1
+
+        if i + 1 == len(refined_message) or refined_message[i + 1] == ' ':
+            words.append(refined_message[word_start_marker:i + 1])
+            word_start_marker = i + 2
+            i = i + 1
+
+        i = i + 1
+
+    return words
+
+
+SAMPLE_LINES = [
+    "Hey, what's up? I was thinking we could go to the lake later... if it doesn't rain!",
+    "Well, that's \"interesting\" - I'd never have guessed it.  Tell me more?",
+    "Perché l’amico ha detto «non lo so» — e poi se n’è andato?",
+    "Oggi è una bella giornata, andiamo al parco… sì, davvero!",
+    "Привет! Как дела? «Ёлка» стоит в углу — красивая, правда?",
+    "Я думаю, что это хорошая идея… но давай подождём до завтра.",
+]
+
+
+def benchmark_tokenizer(megabytes):
+    rng = random.Random(1234)
+
+    messages = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        message = "\n".join(rng.choice(SAMPLE_LINES) for _ in range(rng.randint(1, 4)))
+        messages.append(message)
+        size += len(message.encode("utf-8"))
+
+    print("Splitting " + str(len(messages)) + " messages (" + str(round(size / (1024 * 1024), 1)) + " MB)...\n")
+    print("{:<12} {:>10} {:>12}".format("Tokenizer", "MB/s", "Words"))
+
+    for name, tokenize in (("original", legacy_tokenize), ("current", utils.rag_tokenizer.tokenize)):
+        start = time.perf_counter()
+        word_count = 0
+        for message in messages:
+            word_count += len(tokenize(message))
+        elapsed = time.perf_counter() - start
+
+        print("{:<12} {:>10.2f} {:>12}".format(name, size / (1024 * 1024) / elapsed, word_count))
+
+
+def synthetic_message_pair(rng):
+    return [" ".join(rng.choice(SAMPLE_LINES) for _ in range(rng.randint(1, 3))),
+            " ".join(rng.choice(SAMPLE_LINES) for _ in range(rng.randint(1, 3))),
+            [], "{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime(2024, 1, 1))]
+
+
+def benchmark_history_save(pair_counts, turns=20):
+    rng = random.Random(1234)
+
+    print("{:<10} {:>16} {:>16} {:>18}".format("Pairs", "Full save (ms)", "Journal (ms)", "Compaction (ms)"))
+
+    with tempfile.TemporaryDirectory() as folder:
+        live_log_path = os.path.join(folder, "LiveLog.json")
+        journal_path = os.path.join(folder, "LiveLog_Journal.jsonl")
+
+        for pair_count in pair_counts:
+            history = [synthetic_message_pair(rng) for _ in range(pair_count)]
+            new_pairs = [synthetic_message_pair(rng) for _ in range(turns)]
+
+            # The original way, rewriting the whole log every turn
+            start = time.perf_counter()
+            for message_pair in new_pairs:
+                history.append(message_pair)
+                with open(live_log_path, 'w') as outfile:
+                    json.dump(history, outfile, indent=4)
+            full_time = (time.perf_counter() - start) / turns
+            del history[-turns:]
+
+            # The journal, one line per turn, synced
+            checksum = utils.history_journal.write_live_log(live_log_path, history)
+            utils.history_journal.reset_journal(journal_path, checksum)
+            with open(journal_path, 'a', encoding="utf-8") as outfile:
+                start = time.perf_counter()
+                for message_pair in new_pairs:
+                    history.append(message_pair)
+                    utils.history_journal.append_journal(outfile, [{'op': "append", 'pair': message_pair}])
+                    os.fsync(outfile.fileno())
+                journal_time = (time.perf_counter() - start) / turns
+
+            # Plus the compaction, once every so many changes
+            start = time.perf_counter()
+            utils.history_journal.write_live_log(live_log_path, history)
+            compaction_time = (time.perf_counter() - start) / utils.history_journal.COMPACT_EVERY
+
+            print("{:<10} {:>16.2f} {:>16.2f} {:>18.2f}".format(pair_count, full_time * 1000, journal_time * 1000, compaction_time * 1000))
+
+
+def main(args):
+    if len(args) >= 2 and args[0] == "asr":
+        model_name = args[2] if len(args) >= 3 else os.environ.get("WHISPER_MODEL", "base.en")
+        backend_names = args[3].split(",") if len(args) >= 4 else list(utils.asr_backends.BACKENDS)
+        benchmark_asr(args[1], model_name, backend_names)
+        return
+
+    if len(args) >= 1 and args[0] == "rag-scoring":
+        pair_count = int(args[1]) if len(args) >= 2 else 5000
+        query_count = int(args[2]) if len(args) >= 3 else 500
+        benchmark_rag_scoring(pair_count, query_count)
+        return
+
+    if len(args) >= 1 and args[0] == "tokenizer":
+        benchmark_tokenizer(float(args[1]) if len(args) >= 2 else 4)
+        return
+
+    if len(args) >= 1 and args[0] == "history-save":
+        pair_counts = [int(count) for count in args[1].split(",")] if len(args) >= 2 else [1000, 10000, 100000]
+        benchmark_history_save(pair_counts)
+        return
+
+    print("Usage: python -m utils.benchmark asr <folder of .wav files> [model] [backend,backend,...]")
+    print("       python -m utils.benchmark rag-scoring [message pairs] [queries]")
+    print("       python -m utils.benchmark tokenizer [megabytes]")
+    print("       python -m utils.benchmark history-save [pairs,pairs,...]")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+#
+# Saving for the live chat history. The history in memory (API.Oogabooga_Api_Support.ooga_history) is the real one, and
+# every change to it (appends, pops, deletes, old pairs rolled out to utils.history_segments) gets written out behind it
+# by a writer thread, as one line each on an append-only journal. That way a turn only ever writes its own changes, no
+# matter how long the chat has gotten.
+#
+#   LiveLog.json            - The whole history, as of the last compaction
+#   LiveLog_Journal.jsonl   - Every change since then. The first line says which LiveLog.json it goes on top of (by
+#                             checksum), so a crash halfway through a compaction can't get the changes replayed twice
+#
+# The journal is fsynced once per turn (when save_histories asks for it), not once per change. Every so often the writer
+# folds the journal back into LiveLog.json, through a temp file, so a crash never leaves a half-written log. On boot,
+# LiveLog.json gets loaded and the journal replayed on top of it, cutting off any half-written last line.
+#
+import atexit
+import json
+import os
+import queue
+import threading
+import zlib
+
+LIVE_LOG_PATH = "LiveLog.json"
+JOURNAL_PATH = "LiveLog_Journal.jsonl"
+
+COMPACT_EVERY = 200             # Changes in the journal before we rewrite LiveLog.json
+
+SYNC = None                     # Queued by commit(), to fsync everything before it
+
+journal_queue = queue.Queue()
+writer_thread = None
+journal_count = 0               # Changes in the journal right now
+live_log_checksum = 0           # Of the LiveLog.json the journal goes on top of
+
+
+# Applies one journaled change to a history
+def apply_change(history, change):
+    if change['op'] == "append":
+        history.append(change['pair'])
+    elif change['op'] == "pop":
+        history.pop()
+    elif change['op'] == "delete":
+        del history[change['index']]
+    elif change['op'] == "trim":
+        del history[:change['count']]
+
+
+# Writes the whole history out, through a temp file. Returns the checksum of what was written
+def write_live_log(path, history):
+    data = json.dumps(history, indent=4).encode("utf-8")
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(temp_path, path)
+
+    return zlib.crc32(data)
+
+
+# Starts the journal over, on top of the LiveLog.json with the given checksum
+def reset_journal(path, checksum):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding="utf-8") as outfile:
+        outfile.write(json.dumps({'live_log': checksum}) + "\n")
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(temp_path, path)
+
+
+def append_journal(outfile, changes):
+    for change in changes:
+        outfile.write(json.dumps(change, ensure_ascii=False) + "\n")
+    outfile.flush()
+
+
+# Changes to replay on top of the LiveLog.json with the given checksum. A half-written last line (from a crash) gets cut
+# off, so the next change goes on cleanly. Returns None if the journal isn't for this LiveLog.json (it was already
+# compacted into it, the log was swapped out by hand, or it has no header saying which log it's for)
+def read_journal(path, checksum):
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'rb') as openfile:
+        lines = openfile.read().split(b"\n")
+
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        return None
+
+    if not isinstance(header, dict) or header.get('live_log') != checksum:
+        return None
+
+    changes = []
+    good_length = len(lines[0]) + 1
+    for line in lines[1:]:
+        if line.strip() == b"":
+            good_length += len(line) + 1
+            continue
+        try:
+            changes.append(json.loads(line))
+        except ValueError:
+            with open(path, 'r+b') as openfile:
+                openfile.truncate(good_length)
+            break
+        good_length += len(line) + 1
+
+    return changes
+
+
+# Loads the history (LiveLog.json, plus the journal on top), and starts writing changes behind it
+def load_history():
+    global journal_count
+    global live_log_checksum
+
+    with open(LIVE_LOG_PATH, 'rb') as openfile:
+        data = openfile.read()
+
+    history = json.loads(data)
+    live_log_checksum = zlib.crc32(data)
+
+    changes = read_journal(JOURNAL_PATH, live_log_checksum)
+    if changes is None:
+        changes = []
+
+    for change in changes:
+        apply_change(history, change)
+
+    # Fold whatever was replayed back in now, so the journal always starts out fresh, with a header for this log
+    if changes:
+        live_log_checksum = write_live_log(LIVE_LOG_PATH, history)
+    reset_journal(JOURNAL_PATH, live_log_checksum)
+    journal_count = 0
+
+    start_writer(list(history))
+
+    return history
+
+
+def start_writer(history):
+    global writer_thread
+
+    if writer_thread is not None:
+        return
+
+    writer_thread = threading.Thread(target=journal_writer, args=(history,))
+    writer_thread.daemon = True
+    writer_thread.start()
+
+    # Don't lose anything still queued when we close
+    atexit.register(flush)
+
+
+# Queues up a change to be saved. The history in memory should already have it
+def record(change):
+    journal_queue.put(change)
+
+
+# Ends the turn. Everything recorded so far gets fsynced together, behind us
+def commit():
+    journal_queue.put(SYNC)
+
+
+# Waits until everything queued so far is written, and on disk
+def flush():
+    if writer_thread is not None:
+        commit()
+        journal_queue.join()
+
+
+# Keeps its own copy of the history (sharing the message pairs), moved along change by change as they are written, so a
+# compaction always matches exactly what the journal has
+def journal_writer(history):
+    global journal_count
+
+    outfile = open(JOURNAL_PATH, 'a', encoding="utf-8")
+
+    while True:
+        items = [journal_queue.get()]
+
+        # Grab anything else waiting too, and write it all at once
+        try:
+            while True:
+                items.append(journal_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        changes = [item for item in items if item is not SYNC]
+
+        try:
+            for change in changes:
+                apply_change(history, change)
+
+            if journal_count + len(changes) >= COMPACT_EVERY:
+                outfile.close()
+                compact(history)
+                outfile = open(JOURNAL_PATH, 'a', encoding="utf-8")
+            else:
+                append_journal(outfile, changes)
+                journal_count += len(changes)
+
+                if SYNC in items:
+                    os.fsync(outfile.fileno())
+
+        except Exception as e:
+            print("Issue saving the chat history: " + str(e))
+
+        for item in items:
+            journal_queue.task_done()
+
+
+# Rewrites LiveLog.json in full, and starts the journal over on top of it. If we crash in between, the old journal's
+# header won't match the new LiveLog.json, so it just gets skipped
+def compact(history):
+    global journal_count
+    global live_log_checksum
+
+    live_log_checksum = write_live_log(LIVE_LOG_PATH, history)
+    reset_journal(JOURNAL_PATH, live_log_checksum)
+    journal_count = 0
@@ -0,0 +1,140 @@
+#
+# Older chat history, rolled out of the live log. Once LiveLog.json gets past LIVE_LOG_PAIRS message pairs, the oldest
+# SEGMENT_PAIRS of them get moved out into their own numbered file in Logs/, so the live history (in memory, and on disk)
+# stays the same size no matter how long we've been chatting.
+#
+#   Logs/ChatLog-Segment-0001.json  - A run of old message pairs, same format as the other chat logs
+#   Logs/Segment_Index.json         - Which segment holds which pairs (by their position in all of history)
+#
+# Pairs are counted from the first one ever archived, so the live history carries on right after the last segment.
+# Segments (and any other chat logs in Logs/) get read back on demand, by the RAG and retrospect, with the last few
+# kept around.
+#
+import bisect
+import functools
+import json
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+LIVE_LOG_PAIRS = int(os.environ.get("LIVE_LOG_PAIRS", "1000"))
+SEGMENT_PAIRS = 500
+
+LOGS_FOLDER = "Logs/"
+SEGMENT_PREFIX = "ChatLog-Segment-"
+INDEX_PATH = LOGS_FOLDER + "Segment_Index.json"
+
+LOG_CACHE_SIZE = 4              # Log files to keep loaded, after reading them back
+
+segment_index = None
+segment_starts = []             # Where each segment starts, for finding which one has a pair
+
+
+# Writes JSON through a temp file, so a crash never leaves a half-written one
+def write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as outfile:
+        json.dump(data, outfile, indent=4)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(temp_path, path)
+
+
+# Every segment, in order, as {'file', 'first', 'count'}
+def get_segments():
+    global segment_index, segment_starts
+
+    if segment_index is None:
+        if os.path.isfile(INDEX_PATH):
+            with open(INDEX_PATH, 'r') as openfile:
+                segment_index = json.load(openfile)['segments']
+        else:
+            segment_index = []
+
+        segment_starts = [segment['first'] for segment in segment_index]
+
+    return segment_index
+
+
+def is_segment_file(file):
+    return file.startswith(SEGMENT_PREFIX)
+
+
+# Chat logs in Logs/ that didn't come from us (imported / converted ones), in order
+def imported_log_files():
+    return [file for file in sorted(os.listdir(LOGS_FOLDER))
+            if file.endswith(".json") and file.startswith("ChatLog") and not is_segment_file(file)]
+
+
+# Pairs rolled out of the live log, all time
+def archived_pair_count():
+    segments = get_segments()
+    if not segments:
+        return 0
+
+    return segments[-1]['first'] + segments[-1]['count']
+
+
+# A chat log file from Logs/ (a segment, or an imported log)
+@functools.lru_cache(maxsize=LOG_CACHE_SIZE)
+def read_log(file):
+    with open(LOGS_FOLDER + file, 'r') as openfile:
+        return json.load(openfile)
+
+
+# Archived pairs from start up to (not including) stop, pulled from whichever segments have them
+def read_pairs(start, stop):
+    segments = get_segments()
+    pairs = []
+
+    i = max(bisect.bisect_right(segment_starts, start) - 1, 0)
+    while i < len(segments) and segments[i]['first'] < stop:
+        segment = segments[i]
+        segment_pairs = read_log(segment['file'])
+        pairs += segment_pairs[max(start - segment['first'], 0):min(stop - segment['first'], segment['count'])]
+        i += 1
+
+    return pairs
+
+
+# Every archived pair, one segment at a time
+def iter_segment_pairs():
+    for segment in get_segments():
+        yield read_log(segment['file'])
+
+
+# How many pairs to roll out of a live history this long (none, until it's a whole segment over)
+def rollover_count(live_pair_count):
+    if live_pair_count < LIVE_LOG_PAIRS + SEGMENT_PAIRS:
+        return 0
+
+    return SEGMENT_PAIRS
+
+
+# Saves the oldest live pairs as a new segment. The segment and index are on disk before this returns, so the pairs can
+# then be taken out of the live history
+def archive(pairs):
+    segments = get_segments()
+
+    file = SEGMENT_PREFIX + str(len(segments) + 1).zfill(4) + ".json"
+    write_json(LOGS_FOLDER + file, pairs)
+
+    segments.append({'file': file, 'first': archived_pair_count(), 'count': len(pairs)})
+    segment_starts.append(segments[-1]['first'])
+    write_json(INDEX_PATH, {'segments': segments})
+
+
+# If we crashed after archiving, but before the live history lost those pairs, it'll still start with the last segment.
+# Returns how many pairs to take off the front of it
+def already_archived(history):
+    segments = get_segments()
+    if not segments:
+        return 0
+
+    last_pairs = read_log(segments[-1]['file'])
+    if len(last_pairs) > 0 and history[:len(last_pairs)] == last_pairs:
+        return len(last_pairs)
+
+    return 0
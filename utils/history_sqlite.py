@@ -0,0 +1,258 @@
+#
+# Optional SQLite store for the whole chat history (SQLITE_HISTORY = ON). Every message pair (imported chat logs from
+# Logs/, archived segments and the live log) goes in one table, with its tags and timestamp, kept in step with the live
+# history as it changes. On top of that there's an FTS5 index over the messages for keyword search, and indexes on the
+# timestamps and tags for ranges and tag lookups, so the web UI can search all of history without loading the JSON logs.
+#
+# It runs in WAL mode, so searches read on their own connections while we write. Changes are committed once per turn,
+# along with the journal (utils.history_journal).
+#
+import os
+import re
+import sqlite3
+import threading
+
+import utils.history_segments
+
+from dotenv import load_dotenv
+load_dotenv()
+
+enabled = os.environ.get("SQLITE_HISTORY") == "ON"
+
+DATABASE_PATH = "Logs/ChatHistory.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_pairs (
+    id INTEGER PRIMARY KEY,
+    my_message TEXT NOT NULL,
+    her_message TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS message_pairs_timestamp ON message_pairs (timestamp);
+
+CREATE TABLE IF NOT EXISTS pair_tags (
+    pair_id INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pair_tags_tag ON pair_tags (tag, pair_id);
+CREATE INDEX IF NOT EXISTS pair_tags_pair ON pair_tags (pair_id);
+"""
+
+# Kept in step with message_pairs by the triggers, without storing the text twice
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_pairs_fts USING fts5 (my_message, her_message, content='message_pairs', content_rowid='id');
+
+CREATE TRIGGER IF NOT EXISTS message_pairs_fts_insert AFTER INSERT ON message_pairs BEGIN
+    INSERT INTO message_pairs_fts (rowid, my_message, her_message) VALUES (new.id, new.my_message, new.her_message);
+END;
+CREATE TRIGGER IF NOT EXISTS message_pairs_fts_delete AFTER DELETE ON message_pairs BEGIN
+    INSERT INTO message_pairs_fts (message_pairs_fts, rowid, my_message, her_message) VALUES ('delete', old.id, old.my_message, old.her_message);
+END;
+"""
+
+store_connection = None         # For writing, from whichever thread changes the history
+store_lock = threading.Lock()
+has_fts = False
+
+reader_connections = threading.local()
+
+
+# Opens (or creates) the store, and makes sure it matches the history
+def open_store(live_history):
+    global store_connection, has_fts
+
+    if not enabled or store_connection is not None:
+        return
+
+    with store_lock:
+        connection = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+        # Not every SQLite build has FTS5, searching falls back to a plain scan without it
+        try:
+            connection.executescript(FTS_SCHEMA)
+            has_fts = True
+        except sqlite3.OperationalError as e:
+            print("SQLite history has no FTS5, search will be slower: " + str(e))
+
+        # New stores start empty. And the store only follows the history while it's on, so if it was turned off for a
+        # while it won't match anymore (deletes, counted from the end, would take out the wrong pairs). Either way, it
+        # gets filled in from scratch
+        if not matches_history(connection, live_history):
+            print("Filling in the SQLite history from the chat logs...")
+            refill(connection, live_history)
+
+        connection.commit()
+        store_connection = connection
+
+
+# Pairs in the imported chat logs, all together
+def imported_pair_count():
+    return sum(len(utils.history_segments.read_log(file)) for file in utils.history_segments.imported_log_files())
+
+
+# Same number of pairs as all of history, ending with the live history. (Adding or removing an imported log changes
+# the count, so that gets picked up too)
+def matches_history(connection, live_history):
+    pair_count = connection.execute("SELECT COUNT(*) FROM message_pairs").fetchone()[0]
+    if pair_count != imported_pair_count() + utils.history_segments.archived_pair_count() + len(live_history):
+        return False
+
+    rows = connection.execute("SELECT my_message, her_message, timestamp FROM message_pairs ORDER BY id DESC LIMIT ?",
+                              (len(live_history),)).fetchall()
+    rows.reverse()
+
+    for row, message_pair in zip(rows, live_history):
+        timestamp = message_pair[3] if len(message_pair) > 3 else None
+        if tuple(row) != (message_pair[0], message_pair[1], timestamp):
+            return False
+
+    return True
+
+
+# Empties the store, and copies everything in again. Imported logs first (they're from before us, same as in the RAG),
+# then the segments, then the live history
+def refill(connection, live_history):
+    connection.execute("DELETE FROM message_pairs")
+    connection.execute("DELETE FROM pair_tags")
+
+    for file in utils.history_segments.imported_log_files():
+        for message_pair in utils.history_segments.read_log(file):
+            insert_pair(connection, message_pair)
+
+    for segment_pairs in utils.history_segments.iter_segment_pairs():
+        for message_pair in segment_pairs:
+            insert_pair(connection, message_pair)
+
+    for message_pair in live_history:
+        insert_pair(connection, message_pair)
+
+
+def insert_pair(connection, message_pair):
+    tags = message_pair[2] if len(message_pair) > 2 and message_pair[2] else []
+    timestamp = message_pair[3] if len(message_pair) > 3 else None
+
+    pair_id = connection.execute("INSERT INTO message_pairs (my_message, her_message, timestamp) VALUES (?, ?, ?)",
+                                 (message_pair[0], message_pair[1], timestamp)).lastrowid
+    connection.executemany("INSERT INTO pair_tags (pair_id, tag) VALUES (?, ?)", [(pair_id, tag) for tag in tags])
+
+
+# Mirrors an append onto the live history
+def add_pair(message_pair):
+    if store_connection is None:
+        return
+
+    with store_lock:
+        insert_pair(store_connection, message_pair)
+
+
+# Mirrors a pop / delete. The live history is always the newest pairs, so which one goes is counted from the end (0 is
+# the latest)
+def remove_pair(from_end):
+    if store_connection is None:
+        return
+
+    with store_lock:
+        row = store_connection.execute("SELECT id FROM message_pairs ORDER BY id DESC LIMIT 1 OFFSET ?", (from_end,)).fetchone()
+        if row is None:
+            return
+
+        store_connection.execute("DELETE FROM message_pairs WHERE id = ?", row)
+        store_connection.execute("DELETE FROM pair_tags WHERE pair_id = ?", row)
+
+
+# Ends the turn
+def commit():
+    if store_connection is None:
+        return
+
+    with store_lock:
+        store_connection.commit()
+
+
+#
+#   Reading
+#
+
+def get_reader():
+    connection = getattr(reader_connections, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect("file:" + DATABASE_PATH + "?mode=ro", uri=True)
+        reader_connections.connection = connection
+
+    return connection
+
+
+def rows_to_pairs(connection, rows):
+    message_pairs = []
+    for pair_id, my_message, her_message, timestamp in rows:
+        tags = [row[0] for row in connection.execute("SELECT tag FROM pair_tags WHERE pair_id = ?", (pair_id,))]
+        message_pairs.append([my_message, her_message, tags, timestamp])
+
+    return message_pairs
+
+
+# Search terms, split up the same way FTS5 splits the messages (on anything that isn't a letter or number). A word
+# like "don't" or "well-known" becomes a phrase of its parts, so it still matches
+def search_terms(query):
+    terms = []
+    for word in query.split():
+        parts = re.findall(r"[^\W_]+", word)
+        if parts:
+            terms.append(" ".join(parts))
+
+    return terms
+
+
+# Best matching message pairs for some keywords, best first
+def search(query, limit=10):
+    if store_connection is None:
+        return []
+
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    connection = get_reader()
+
+    if has_fts:
+        rows = connection.execute("SELECT message_pairs.id, message_pairs.my_message, message_pairs.her_message, timestamp FROM message_pairs_fts "
+                                  "JOIN message_pairs ON message_pairs.id = message_pairs_fts.rowid "
+                                  "WHERE message_pairs_fts MATCH ? ORDER BY bm25(message_pairs_fts) LIMIT ?",
+                                  (" OR ".join('"' + term + '"' for term in terms), limit)).fetchall()
+    else:
+        words = [word.strip("\"'.,!?()") for word in query.split()]
+        words = [word for word in words if word]
+        conditions = " OR ".join("(my_message LIKE ? OR her_message LIKE ?)" for _ in words)
+        patterns = [pattern for word in words for pattern in ("%" + word + "%",) * 2]
+        rows = connection.execute("SELECT id, my_message, her_message, timestamp FROM message_pairs WHERE " + conditions +
+                                  " ORDER BY id DESC LIMIT ?", patterns + [limit]).fetchall()
+
+    return rows_to_pairs(connection, rows)
+
+
+# Message pairs from start up to (not including) end, as "%Y-%m-%d %H:%M:%S" timestamps, oldest first
+def pairs_between(start, end, limit=100):
+    if store_connection is None:
+        return []
+
+    connection = get_reader()
+    rows = connection.execute("SELECT id, my_message, her_message, timestamp FROM message_pairs "
+                              "WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp LIMIT ?", (start, end, limit)).fetchall()
+
+    return rows_to_pairs(connection, rows)
+
+
+# The latest message pairs with a tag, newest first
+def pairs_tagged(tag, limit=100):
+    if store_connection is None:
+        return []
+
+    connection = get_reader()
+    rows = connection.execute("SELECT message_pairs.id, my_message, her_message, timestamp FROM pair_tags "
+                              "JOIN message_pairs ON message_pairs.id = pair_tags.pair_id "
+                              "WHERE tag = ? ORDER BY pair_tags.pair_id DESC LIMIT ?", (tag, limit)).fetchall()
+
+    return rows_to_pairs(connection, rows)
@@ -5,11 +5,11 @@ import mouse
 import time
 import threading
 import utils.alarm
-import utils.volume_listener
 import utils.settings
 import json
 import utils.custom_logging
 import utils.audio
+import utils.vad
 
 
 RATE_PRESSED = False
@@ -26,8 +26,8 @@ BACKSLASH_PRESSED = False
 SPEAK_TOGGLED = False
 
 FULL_AUTO_TOGGLED = False
-SPEAKING_TIMER = 0
-SPEAKING_TIMER_COOLDOWN = 0
+AUTOCHAT_EVENT = threading.Event()      # Set while autochat is on, so threads can sleep until it is
+SPEAKING_COOLDOWN_UNTIL = 0            # Time (from time.time()) that we start listening again after she talks
 SPEAKING_VOLUME_SENSITIVITY = 20
 SPEAKING_VOLUME_SENSITIVITY_PRESSED = False
 
@@ -144,7 +144,7 @@ def redo_input():
     REDO_PRESSED = True
 
 def get_speak_input():
-    if SPEAKING_TIMER_COOLDOWN > 0:
+    if time.time() < SPEAKING_COOLDOWN_UNTIL:
         return False
 
     return SPEAK_TOGGLED
@@ -251,6 +251,7 @@ def input_toggle_autochat():
         return
 
     FULL_AUTO_TOGGLED = not FULL_AUTO_TOGGLED
+    update_autochat_event()
     print("\nFull Auto Set To " + str(FULL_AUTO_TOGGLED) + " !")
 
     # Disable semi-auto
@@ -258,15 +259,24 @@ def input_toggle_autochat():
 
 
 
+def update_autochat_event():
+    if FULL_AUTO_TOGGLED:
+        AUTOCHAT_EVENT.set()
+    else:
+        AUTOCHAT_EVENT.clear()
+
+
 # For when semi-auto chat is turned on
 def disable_autochat():
     global FULL_AUTO_TOGGLED
     FULL_AUTO_TOGGLED = False
+    update_autochat_event()
 
 def input_toggle_autochat_from_ui():
     global FULL_AUTO_TOGGLED
 
     FULL_AUTO_TOGGLED = not FULL_AUTO_TOGGLED
+    update_autochat_event()
     print("\nFull Auto Set To " + str(FULL_AUTO_TOGGLED) + " !")
 
     # Disable semi-auto
@@ -286,52 +296,39 @@ def input_toggle_semi_autochat():
 
     print("\nSemi-Auto Chat set to " + str(utils.settings.semi_auto_chat) + " !")
 
-def listener_timer():
-    global SPEAK_TOGGLED
-    global SPEAKING_TIMER
-    global SPEAKING_TIMER_COOLDOWN
-
-
-    while True:
-        vol_listener_level = utils.volume_listener.get_vol_level()
-
-        # If we are speaking, add to counter, if not remove from it
-        if (vol_listener_level > SPEAKING_VOLUME_SENSITIVITY) and (SPEAKING_TIMER_COOLDOWN == 0):
-            SPEAKING_TIMER += 50
-            if SPEAKING_TIMER > 99:
-                SPEAKING_TIMER = 99
-
-        else:
-            SPEAKING_TIMER -= 1
-            if SPEAKING_TIMER < 0:
-                SPEAKING_TIMER = 0
-
+# Hooks autochat up to the voice activity detection. No more polling, the VAD tells us when talking starts and stops
+def start_speech_listener():
+    utils.vad.set_sensitivity(SPEAKING_VOLUME_SENSITIVITY)
+    utils.vad.add_speech_start_listener(on_speech_start)
+    utils.vad.add_speech_end_listener(on_speech_end)
+    utils.vad.start_vad()
 
 
-        # No full auto indoors! Check to see if we need to flop it lmao
-        if FULL_AUTO_TOGGLED:
-            if (SPEAKING_TIMER == 0 or SPEAKING_TIMER_COOLDOWN > 0) and SPEAK_TOGGLED == True:
-                SPEAK_TOGGLED = False
+def on_speech_start():
+    global SPEAK_TOGGLED
 
-            elif SPEAKING_TIMER > 0 and SPEAK_TOGGLED == False:
-                SPEAK_TOGGLED = True
+    # Still cooling down from her talking, throw it out so we pick it up again afterward if it's really us
+    if time.time() < SPEAKING_COOLDOWN_UNTIL:
+        utils.vad.reset()
+        return
 
+    # No full auto indoors!
+    if FULL_AUTO_TOGGLED and SPEAK_TOGGLED == False:
+        SPEAK_TOGGLED = True
 
 
-        # End of loop, clock cycle time
-        SPEAKING_TIMER_COOLDOWN -= 0.02
-        if SPEAKING_TIMER_COOLDOWN < 0:
-            SPEAKING_TIMER_COOLDOWN = 0
+def on_speech_end():
+    global SPEAK_TOGGLED
 
-        time.sleep(0.02)
+    if FULL_AUTO_TOGGLED and SPEAK_TOGGLED == True:
+        SPEAK_TOGGLED = False
 
 
 def cooldown_listener_timer():
-    global SPEAKING_TIMER
-    global SPEAKING_TIMER_COOLDOWN
+    global SPEAKING_COOLDOWN_UNTIL
 
-    SPEAKING_TIMER = 0
-    SPEAKING_TIMER_COOLDOWN = 0.47
+    utils.vad.reset()
+    SPEAKING_COOLDOWN_UNTIL = time.time() + 0.47
 
 
 def input_change_listener_sensitivity():
@@ -350,6 +347,7 @@ def input_change_listener_sensitivity():
         SPEAKING_VOLUME_SENSITIVITY = 104
     elif SPEAKING_VOLUME_SENSITIVITY >= 104:
         SPEAKING_VOLUME_SENSITIVITY = 9
+    utils.vad.set_sensitivity(SPEAKING_VOLUME_SENSITIVITY)
     print("\nSensitivity Set To " + str(SPEAKING_VOLUME_SENSITIVITY) + " !")
 
 
@@ -357,6 +355,7 @@ def input_change_listener_sensitivity_from_ui(value):
     global SPEAKING_VOLUME_SENSITIVITY
 
     SPEAKING_VOLUME_SENSITIVITY = value
+    utils.vad.set_sensitivity(SPEAKING_VOLUME_SENSITIVITY)
 
     print("\nSensitivity Set To " + str(SPEAKING_VOLUME_SENSITIVITY) + " !")
 
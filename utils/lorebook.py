@@ -1,11 +1,23 @@
-import utils.cane_lib
+import collections
 import json
 import utils.custom_logging
+import utils.rag_tokenizer
 
 do_log_lore = True
 total_lore_default = "Here is some lore about the current topic from your lorebook;\n\n"
 
 
+# Characters that can come right after a keyword for it to count (or an "s", for plurals)
+KEYWORD_FOLLOWERS = frozenset(" \'s!.,?")
+
+# All the lorebook keywords, compiled into one Aho-Corasick automaton (goto, fail and output tables), so each message
+# only gets read through once, no matter how many entries there are. Keywords match with the space in front, " dragon"
+lore_matcher = ([{}], [0], [[]])
+
+# Single word keywords, the way the RAG splits words, for checking its words against
+rag_keywords = frozenset()
+
+
 # Load the LORE_BOOK, it is now JSON configurable!
 with open("Configurables/Lorebook.json", 'r') as openfile:
     LORE_BOOK = json.load(openfile)
@@ -34,6 +46,76 @@ with open("Configurables/Lorebook.json", 'r') as openfile:
 #
 #     return "No lore!"
 
+# Builds the matcher and keyword set from the LORE_BOOK. Call this again if it ever changes
+def compile_lorebook():
+    global lore_matcher, rag_keywords
+
+    # Keyword -> lore entries with it (in lorebook order)
+    keyword_entries = {}
+    for lore_index, lore in enumerate(LORE_BOOK):
+        keyword_entries.setdefault(" " + str.lower(lore['0']), []).append(lore_index)
+
+    # Trie of the keywords. Outputs are what ends at each state, as (keyword length, lore entries)
+    goto = [{}]
+    outputs = [[]]
+    for keyword, lore_indexes in keyword_entries.items():
+        state = 0
+        for char in keyword:
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                outputs.append([])
+            state = goto[state][char]
+        outputs[state].append((len(keyword), lore_indexes))
+
+    # Failure links, breadth first, so any keyword ending inside a longer one gets found too
+    fail = [0] * len(goto)
+    pending = collections.deque(goto[0].values())
+    while pending:
+        state = pending.popleft()
+        for char, next_state in goto[state].items():
+            pending.append(next_state)
+
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+
+            outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+
+    lore_matcher = (goto, fail, outputs)
+
+    new_rag_keywords = set()
+    for lore in LORE_BOOK:
+        keyword_words = utils.rag_tokenizer.tokenize(lore['0'])
+        if len(keyword_words) == 1:
+            new_rag_keywords.add(keyword_words[0])
+    rag_keywords = frozenset(new_rag_keywords)
+
+
+# Indexes of every lore entry with its keyword in the message (not case sensitive)
+def find_lore(message):
+    goto, fail, outputs = lore_matcher
+
+    text = str.lower(message)
+    found = set()
+
+    state = 0
+    for i, char in enumerate(text):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+
+        if outputs[state] and i + 1 < len(text) and text[i + 1] in KEYWORD_FOLLOWERS:
+            for keyword_length, lore_indexes in outputs[state]:
+                found.update(lore_indexes)
+
+    return found
+
+
+compile_lorebook()
+
+
 # Gathers ALL lore in a given scope (send in the message being sent, as well as any message pairs you want to check)
 def lorebook_gather(messages, sent_message):
 
@@ -47,20 +129,15 @@ def lorebook_gather(messages, sent_message):
     # gather all of our lore in one spot
     total_lore = total_lore_default
 
-    # Reset all lore entry cooldown
-    for lore in LORE_BOOK:
-        lore['2'] = 0
+    # Lore that has procced already, to prevent dupes
+    procced = set()
 
-    # Search every lore entry for each of the messages, and add the lore as needed
+    # Search each of the messages for every lore entry at once, and add the lore as needed (in lorebook order)
     for message in reformed_messages:
-        # Search for new ones
-        for lore in LORE_BOOK:
-            if utils.cane_lib.keyword_check(message, [" " + lore['0'] + " ", " " + lore['0'] + "\'", " " + lore['0'] + "s",
-                                                      " " + lore['0'] + "!", " " + lore['0'] + ".", " " + lore['0'] + ",", " " + lore['0'] + "?",
-                                                      ]) and lore['2'] == 0:
-
-                total_lore += (lore['0'] + ", " + lore['1'] + "\n\n")
-                lore['2'] = 7   # lore has procced, prevent dupes
+        for lore_index in sorted(find_lore(message) - procced):
+            lore = LORE_BOOK[lore_index]
+            total_lore += (lore['0'] + ", " + lore['1'] + "\n\n")
+            procced.add(lore_index)
 
     if do_log_lore and total_lore != total_lore_default:
         utils.custom_logging.update_debug_log(total_lore)
@@ -72,10 +149,5 @@ def lorebook_gather(messages, sent_message):
 
 # Check if keyword is in the lorebook
 def rag_word_check(word):
-    # Lockout clearing
-    for lore in LORE_BOOK:
-        if str.lower(lore['0']) == word:
-            return True
-
-    return False
+    return word in rag_keywords
 
@@ -0,0 +1,154 @@
+#
+# The one and only microphone capture. A single input stream stays open for the whole session and writes into a
+# preallocated ring buffer. Everything else that wants mic audio (the volume meter, the autochat buffer, recording
+# your turns) reads from here, instead of each opening their own stream.
+#
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+RATE = 44100
+CHANNELS = 1
+CHUNK = 1024
+
+BUFFER_SECONDS = 30                     # How far back readers can fall before they start losing audio
+BUFFER_SIZE = RATE * BUFFER_SECONDS
+
+STREAM_CHECK_SECONDS = 1                # How often to check that the stream is still going, and wait before reopening it
+
+ring_buffer = np.zeros(BUFFER_SIZE, dtype=np.int16)
+
+# Total samples written since the capture started. Readers keep their own position and compare against this
+write_position = 0
+new_audio = threading.Condition()
+
+# Functions that get called with every new block of audio (as an int16 view into the ring buffer, do not hold on to it!)
+block_listeners = []
+
+no_mic = False
+capture_started = False
+
+
+def audio_callback(indata, frames, time, status):
+    global write_position
+
+    block = indata[:, 0]
+    start = write_position % BUFFER_SIZE
+    end = start + frames
+
+    # Write in, wrapping around the end of the buffer if needed
+    if end <= BUFFER_SIZE:
+        ring_buffer[start:end] = block
+    else:
+        split = BUFFER_SIZE - start
+        ring_buffer[start:] = block[:split]
+        ring_buffer[:end - BUFFER_SIZE] = block[split:]
+
+    with new_audio:
+        write_position += frames
+        new_audio.notify_all()
+
+    # A listener breaking shouldn't take the whole stream (and everyone else reading from it) down with it
+    for listener in block_listeners:
+        try:
+            listener(block)
+        except Exception as e:
+            print("Issue with a mic listener: " + str(e))
+
+
+def add_block_listener(listener):
+    block_listeners.append(listener)
+
+
+def get_position():
+    return write_position
+
+
+# Waits until the capture has written up to the given position. Returns False if it timed out first
+def wait_for_position(position, timeout=None):
+    with new_audio:
+        return new_audio.wait_for(lambda: write_position >= position, timeout)
+
+
+# Returns the samples between two positions. Zero-copy view when the range doesn't wrap around the end of the buffer
+def read_range(start, end):
+    if end - start > BUFFER_SIZE:
+        start = end - BUFFER_SIZE
+
+    ring_start = start % BUFFER_SIZE
+    ring_end = ring_start + (end - start)
+
+    if ring_end <= BUFFER_SIZE:
+        return ring_buffer[ring_start:ring_end]
+
+    return np.concatenate((ring_buffer[ring_start:], ring_buffer[:ring_end - BUFFER_SIZE]))
+
+
+# Reads the next chunk for a reader, blocking until it is there. Gives back a view of the samples, and where to read from
+# next. If the reader fell too far behind, it skips ahead to the oldest audio still in the buffer.
+def read_chunk_view(position, chunk_size=CHUNK, timeout=None):
+    if write_position - position > BUFFER_SIZE - chunk_size:
+        position = write_position - BUFFER_SIZE + chunk_size
+
+    if not wait_for_position(position + chunk_size, timeout):
+        return None, position
+
+    return read_range(position, position + chunk_size), position + chunk_size
+
+
+# Same as above, but as raw bytes that are safe to hold on to
+def read_chunk(position, chunk_size=CHUNK, timeout=None):
+    samples, position = read_chunk_view(position, chunk_size, timeout)
+    if samples is None:
+        return None, position
+
+    return samples.tobytes(), position
+
+
+def check_for_mic():
+    global no_mic
+
+    sound_query = sd.query_devices()
+    for devices in sound_query:
+        if devices['max_input_channels'] != 0:
+            return True
+
+    no_mic = True
+    return False
+
+
+# Checks for a mic, and starts up the capture stream in its own thread
+def start_capture():
+
+    if not check_for_mic():
+        print("No mic detected!")
+        return
+
+    capture_thread = threading.Thread(target=run_capture)
+    capture_thread.daemon = True
+    capture_thread.start()
+
+
+# Opens the one input stream, and keeps it open forever. If it stops (the mic got unplugged, the driver had an issue...)
+# it gets opened again, and readers carry on from where the audio picks back up
+def run_capture():
+    global capture_started
+
+    while True:
+        try:
+            stream = sd.InputStream(samplerate=RATE, channels=CHANNELS, dtype='int16', blocksize=CHUNK, callback=audio_callback)
+
+            with stream:
+                capture_started = True
+
+                while stream.active:
+                    sd.sleep(STREAM_CHECK_SECONDS * 1000)
+
+            print("Mic stream stopped, opening it again...")
+
+        except Exception as e:
+            print("Issue with the mic stream, opening it again: " + str(e))
+
+        time.sleep(STREAM_CHECK_SECONDS)
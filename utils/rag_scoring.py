@@ -0,0 +1,378 @@
+#
+# Scoring engines for the RAG (utils.based_rag). Each one keeps its own index of which words are in which stored message
+# pairs, and finds the message pair that best matches a set of keywords. Pick one with RAG_ENGINE in the .env.
+#
+#   "postings"  - Inverted index (word -> messages), and only evaluates the messages that have a keyword. Pure Python
+#   "numpy"     - Sparse message x word matrix (CSR) in NumPy, scores every message at once with one mat-vec
+#
+# Messages keep all of their words. Really common words are left out when scoring instead (see CommonWords), both from
+# the keywords and from the message lengths.
+#
+# Writers change an engine in place, but only ever on the end, past what anyone already had. view() hands out a read-only
+# copy (sharing the arrays) that later changes don't touch, so scoring never has to lock. An undo is the one thing that
+# would write over old rows, so it makes fresh copies first.
+#
+# Both give the exact same pick as the original full scan (full_scan_best_message), tests/test_rag_scoring.py checks
+# that. This is kept light (no app imports), so the tests and "python -m utils.benchmark rag-scoring" can load it alone.
+#
+import copy
+
+import numpy as np
+
+
+# Totals and returns the value of a given message, when tied to keywords
+def evaluate_message(valued_word_ids, hist_word_ids):
+
+    i = 0
+    value = 0
+
+    # Compares for each valued word, so it won't ever do repeats
+    while i < len(valued_word_ids):
+        if hist_word_ids.__contains__(valued_word_ids[i]):
+            value = value + 1
+
+        i = i + 1
+
+    # Reduce the value of the statement if it is long, to avoid "fillabustering" (content getting picked via mass)
+    value = value - (len(hist_word_ids) / 120)
+
+    # Never less than 0
+    if value < 0:
+        value = 0
+
+
+    return value
+
+
+# Which words are too common to search on, as a bitmap over word IDs. A word is common once its count goes over ratio x
+# the total word count (rounded down). That limit only moves every so often as the total grows, and only then does the
+# whole bitmap get redone; otherwise just the words that were counted get checked again
+class CommonWords:
+
+    def __init__(self, ratio):
+        self.ratio = ratio
+        self.limit = -1
+        self.bitmap = np.zeros(0, dtype=bool)
+
+    def rebuild(self, counts, total_word_count):
+        self.limit = int(self.ratio * total_word_count)
+        self.bitmap = np.asarray(counts, dtype=np.int64) > self.limit
+
+    # After the given words were counted (new words included). Always makes a new bitmap, anyone holding the old one
+    # keeps seeing it as it was
+    def update(self, counts, total_word_count, word_ids):
+        if int(self.ratio * total_word_count) != self.limit:
+            self.rebuild(counts, total_word_count)
+            return
+
+        bitmap = np.concatenate((self.bitmap, np.zeros(max(0, len(counts) - len(self.bitmap)), dtype=bool)))
+        for word_id in set(word_ids):
+            bitmap[word_id] = counts[word_id] > self.limit
+
+        self.bitmap = bitmap
+
+
+# Just the words that aren't common
+def searchable_words(word_ids, common):
+    return [word_id for word_id in word_ids if not common[word_id]]
+
+
+# The original RAG pick: prune the common words out of every message, score them all, then walk them all keeping the
+# latest best one. Far too slow to use, but it's what the engines have to match
+def full_scan_best_message(keyword_ids, my_messages, her_messages, first_id, last_id, common):
+    keyword_ids = searchable_words(keyword_ids, common)
+    scores = [evaluate_message(keyword_ids, searchable_words(my_messages[i], common))
+              + evaluate_message(keyword_ids, searchable_words(her_messages[i], common))
+              for i in range(len(my_messages))]
+
+    best_message_score = 0
+    best_message_id = 0
+    for i in range(first_id, last_id + 1):
+        if best_message_score <= scores[i]:
+            best_message_id = i
+            best_message_score = scores[i]
+
+    return best_message_id
+
+
+class PostingsEngine:
+
+    name = "postings"
+
+    def __init__(self):
+        self.messages = []                          # (my word IDs, her word IDs) for each message pair
+        self.postings = ({}, {})                    # Word ID -> message IDs with that word, for me and for her
+        self.count = 0                              # Messages in this index (a view can be behind the lists)
+
+    def build(self, my_messages, her_messages):
+        self.messages = []
+        self.postings = ({}, {})
+        self.count = 0
+
+        for my_word_ids, her_word_ids in zip(my_messages, her_messages):
+            self.add_message(my_word_ids, her_word_ids)
+
+    # Message IDs only ever get added on the end, so the postings stay sorted
+    def add_message(self, my_word_ids, her_word_ids):
+        message_id = self.count
+        self.messages.append((my_word_ids, her_word_ids))
+
+        for postings, word_ids in zip(self.postings, self.messages[-1]):
+            for word_id in dict.fromkeys(word_ids):
+                postings.setdefault(word_id, []).append(message_id)
+
+        self.count += 1
+
+    # Views still have the message, so this takes it out of fresh copies
+    def remove_latest(self):
+        removed_message = self.messages[-1]
+        self.messages = self.messages[:-1]
+        self.postings = (dict(self.postings[0]), dict(self.postings[1]))
+        self.count -= 1
+
+        for postings, word_ids in zip(self.postings, removed_message):
+            for word_id in dict.fromkeys(word_ids):
+                word_messages = postings[word_id][:-1]
+                if word_messages:
+                    postings[word_id] = word_messages
+                else:
+                    del postings[word_id]
+
+    def message_count(self):
+        return self.count
+
+    def view(self):
+        return copy.copy(self)
+
+    # Every message that has at least one of the keywords, on either side, with its score
+    def candidate_scores(self, keyword_ids, common):
+        keyword_ids = searchable_words(keyword_ids, common)
+
+        candidates = set()
+        for word_id in set(keyword_ids):
+            candidates.update(self.postings[0].get(word_id, ()))
+            candidates.update(self.postings[1].get(word_id, ()))
+
+        scores = {}
+        for message_id in candidates:
+
+            # Added after this view was made
+            if message_id >= self.count:
+                continue
+
+            my_word_ids, her_word_ids = self.messages[message_id]
+            scores[message_id] = (evaluate_message(keyword_ids, searchable_words(my_word_ids, common))
+                                  + evaluate_message(keyword_ids, searchable_words(her_word_ids, common)))
+
+        return scores
+
+    # Score for every message (anything that isn't a candidate is 0)
+    def message_scores(self, keyword_ids, common):
+        scores = np.zeros(self.count)
+        for message_id, score in self.candidate_scores(keyword_ids, common).items():
+            scores[message_id] = score
+
+        return scores
+
+    # Best scoring message between the two IDs (inclusive, and first_id <= last_id). More recent ones win ties, so with
+    # nothing scoring at all, it is the last one. Common words (a bitmap, see CommonWords) don't count
+    def best_message(self, keyword_ids, first_id, last_id, common):
+        best_message_id = last_id
+        best_message_score = 0
+
+        for message_id, score in self.candidate_scores(keyword_ids, common).items():
+            if message_id < first_id or message_id > last_id:
+                continue
+
+            if score > best_message_score or (score == best_message_score and score > 0 and message_id > best_message_id):
+                best_message_id = message_id
+                best_message_score = score
+
+        return best_message_id
+
+
+# Growable CSR matrix, one row per message, holding the distinct word IDs in it and how many times each one is used
+# (plus the full length, repeats and all)
+class MessageMatrix:
+
+    def __init__(self):
+        self.rows = 0
+        self.nonzeros = 0
+        self.indptr = np.zeros(1025, dtype=np.int64)
+        self.indices = np.zeros(4096, dtype=np.uint32)
+        self.counts = np.zeros(4096, dtype=np.int64)
+        self.row_ids = np.zeros(4096, dtype=np.int64)       # Row of each entry, so scoring is one bincount
+        self.lengths = np.zeros(1024, dtype=np.int64)
+        self.word_limit = 1                                 # Highest word ID in here, plus one
+
+    def build(self, messages):
+
+        # Stored flat already (see utils.rag_store.MessageWordIDs), or a plain list of lists
+        if hasattr(messages, "flat"):
+            flat, offsets = messages.flat()
+            flat = flat.astype(np.int64)
+            lengths = np.diff(offsets)
+        else:
+            lengths = np.fromiter((len(word_ids) for word_ids in messages), dtype=np.int64, count=len(messages))
+            flat = np.fromiter((word_id for word_ids in messages for word_id in word_ids), dtype=np.int64, count=int(lengths.sum()))
+
+        rows = np.repeat(np.arange(len(messages), dtype=np.int64), lengths)
+
+        # Distinct (row, word) pairs, in row order
+        width = int(flat.max()) + 1 if len(flat) > 0 else 1
+        keys, counts = np.unique(rows * width + flat, return_counts=True)
+        row_ids = keys // width
+        indices = (keys % width).astype(np.uint32)
+
+        self.rows = len(messages)
+        self.nonzeros = len(keys)
+        self.word_limit = width
+        self.lengths = np.concatenate((lengths, np.zeros(1024, dtype=np.int64)))
+        self.row_ids = np.concatenate((row_ids, np.zeros(4096, dtype=np.int64)))
+        self.indices = np.concatenate((indices, np.zeros(4096, dtype=np.uint32)))
+        self.counts = np.concatenate((counts.astype(np.int64), np.zeros(4096, dtype=np.int64)))
+        self.indptr = np.zeros(self.rows + 1025, dtype=np.int64)
+        self.indptr[1:self.rows + 1] = np.cumsum(np.bincount(row_ids, minlength=self.rows))
+
+    def append(self, word_ids):
+        distinct, counts = np.unique(np.asarray(word_ids, dtype=np.uint32), return_counts=True)
+
+        # Double up whenever we run out of room
+        if self.rows + 1 >= len(self.lengths):
+            self.lengths = np.concatenate((self.lengths, np.zeros(len(self.lengths), dtype=np.int64)))
+            self.indptr = np.concatenate((self.indptr, np.zeros(len(self.indptr), dtype=np.int64)))
+        if self.nonzeros + len(distinct) > len(self.indices):
+            extra = max(len(self.indices), len(distinct))
+            self.indices = np.concatenate((self.indices, np.zeros(extra, dtype=np.uint32)))
+            self.row_ids = np.concatenate((self.row_ids, np.zeros(extra, dtype=np.int64)))
+            self.counts = np.concatenate((self.counts, np.zeros(extra, dtype=np.int64)))
+
+        self.indices[self.nonzeros:self.nonzeros + len(distinct)] = distinct
+        self.counts[self.nonzeros:self.nonzeros + len(distinct)] = counts
+        self.row_ids[self.nonzeros:self.nonzeros + len(distinct)] = self.rows
+        self.lengths[self.rows] = len(word_ids)
+        if len(distinct) > 0:
+            self.word_limit = max(self.word_limit, int(distinct[-1]) + 1)
+        self.nonzeros += len(distinct)
+        self.rows += 1
+        self.indptr[self.rows] = self.nonzeros
+
+    # The next append would write over the row that views still have, so give ourselves fresh arrays first
+    def remove_latest(self):
+        self.indptr = self.indptr.copy()
+        self.indices = self.indices.copy()
+        self.counts = self.counts.copy()
+        self.row_ids = self.row_ids.copy()
+        self.lengths = self.lengths.copy()
+
+        self.rows -= 1
+        self.nonzeros = int(self.indptr[self.rows])
+
+    # Keyword hits minus the length penalty, floored at 0, for every message, leaving out the common words. Same math as
+    # evaluate_message
+    def score(self, keyword_ids, common):
+        indices = self.indices[:self.nonzeros]
+        row_ids = self.row_ids[:self.nonzeros]
+
+        # How many times each word is a keyword (the keyword list can have repeats)
+        keyword_ids = np.asarray(searchable_words(keyword_ids, common), dtype=np.int64)
+        keyword_weights = np.bincount(keyword_ids, minlength=self.word_limit).astype(np.float64)
+
+        hits = np.bincount(row_ids, weights=keyword_weights[indices], minlength=self.rows)
+
+        # Lengths without the common words
+        common_entries = common[indices]
+        common_uses = np.bincount(row_ids[common_entries], weights=self.counts[:self.nonzeros][common_entries], minlength=self.rows)
+
+        return np.maximum(hits - (self.lengths[:self.rows] - common_uses) / 120, 0)
+
+
+class NumpyEngine:
+
+    name = "numpy"
+
+    def __init__(self):
+        self.matrices = (MessageMatrix(), MessageMatrix())      # Me, her
+
+    def build(self, my_messages, her_messages):
+        self.matrices[0].build(my_messages)
+        self.matrices[1].build(her_messages)
+
+    def add_message(self, my_word_ids, her_word_ids):
+        self.matrices[0].append(my_word_ids)
+        self.matrices[1].append(her_word_ids)
+
+    def remove_latest(self):
+        self.matrices[0].remove_latest()
+        self.matrices[1].remove_latest()
+
+    def message_count(self):
+        return self.matrices[0].rows
+
+    def view(self):
+        engine_view = copy.copy(self)
+        engine_view.matrices = (copy.copy(self.matrices[0]), copy.copy(self.matrices[1]))
+        return engine_view
+
+    def message_scores(self, keyword_ids, common):
+        return self.matrices[0].score(keyword_ids, common) + self.matrices[1].score(keyword_ids, common)
+
+    def best_message(self, keyword_ids, first_id, last_id, common):
+        scores = self.message_scores(keyword_ids, common)[first_id:last_id + 1]
+
+        # Latest of the best (argmax on the reversed scores finds the last one)
+        return last_id - int(np.argmax(scores[::-1]))
+
+
+# Top scoring runs of window_size messages in a row, between two IDs (inclusive). Every window gets its summed score from
+# one cumulative sum, then we take the best ones that don't overlap and fit in the character budget (window_chars(start)
+# gives the size of a window). More recent windows win ties. Returns their start IDs, oldest first
+def best_windows(scores, first_id, last_id, window_size, window_count, window_chars, char_budget):
+    window_size = max(1, min(window_size, last_id - first_id + 1))
+
+    sums = np.cumsum(np.concatenate(([0.0], scores[first_id:last_id + 1])))
+    window_scores = np.round(sums[window_size:] - sums[:-window_size], 9)   # Rounded, so float noise can't break ties
+
+    # Best first, then most recent first
+    order = np.lexsort((-np.arange(len(window_scores)), -window_scores))
+
+    taken = np.zeros(last_id + 1, dtype=bool)
+    chosen = []
+    used_chars = 0
+    for j in order:
+        if window_scores[j] <= 0 or len(chosen) >= window_count:
+            break
+
+        start = first_id + int(j)
+        if taken[start:start + window_size].any():
+            continue
+
+        chars = window_chars(start)
+        if used_chars + chars > char_budget:
+            continue
+
+        chosen.append(start)
+        used_chars += chars
+        taken[start:start + window_size] = True
+
+    # Nothing scored (or nothing fit), so just go with the top window, same as the single message pick would
+    if len(chosen) == 0:
+        chosen.append(first_id + int(order[0]) if window_scores[order[0]] > 0 else last_id - window_size + 1)
+
+    return sorted(chosen)
+
+
+ENGINES = {
+    PostingsEngine.name: PostingsEngine,
+    NumpyEngine.name: NumpyEngine,
+}
+
+
+def create_engine(engine_name):
+    engine_name = str(engine_name).strip().lower()
+
+    if engine_name not in ENGINES:
+        print("Unknown RAG engine '" + engine_name + "', using '" + PostingsEngine.name + "' instead!")
+        engine_name = PostingsEngine.name
+
+    return ENGINES[engine_name]()
@@ -0,0 +1,358 @@
+#
+# On-disk storage for the RAG (utils.based_rag).
+#
+#   LiveRAG_Snapshot.bin  - Versioned binary snapshot of the whole index. Words and their counts are stored as arrays,
+#                           and all of the message word IDs as one flat uint32 array plus offsets. The messages
+#                           themselves aren't stored, just where to find them in the chat logs (see RagHistory).
+#                           Loading it is a few array copies instead of parsing JSON, but it still grows with the
+#                           history, and the scoring engine gets re-indexed from the word IDs after.
+#   LiveRAG_Delta.jsonl   - Append-only log of what changed since the snapshot (message pairs added, undos). Each turn
+#                           only appends its own line, and it gets folded back into a new snapshot every so often.
+#
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import utils.history_segments
+import utils.rag_tokenizer
+
+SNAPSHOT_MAGIC = b"ZWRAGSNP"
+SNAPSHOT_VERSION = 4
+HISTORY_REFS_VERSION = 4        # Before this, snapshots stored the text of every message (and older ones, pruned word IDs)
+
+START_PAIR = ["Start of all history!", "Start of all history!"]
+START_REF = -1
+
+
+# Word IDs for every stored message. The ones loaded from a snapshot stay in one flat array (read only), anything
+# added after that goes on the end as normal lists. Reads like a list of lists
+class MessageWordIDs:
+
+    def __init__(self, flat_ids=None, offsets=None):
+        self.flat_ids = flat_ids if flat_ids is not None else np.zeros(0, dtype=np.uint32)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.flat_count = len(self.offsets) - 1
+        self.tail = []
+
+    @classmethod
+    def from_lists(cls, word_id_lists):
+        lengths = np.fromiter((len(word_ids) for word_ids in word_id_lists), dtype=np.int64, count=len(word_id_lists))
+        flat_ids = np.fromiter((word_id for word_ids in word_id_lists for word_id in word_ids), dtype=np.uint32, count=int(lengths.sum()))
+        return cls(flat_ids, np.concatenate(([0], np.cumsum(lengths))))
+
+    def __len__(self):
+        return self.flat_count + len(self.tail)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("message index out of range")
+
+        if i < self.flat_count:
+            return self.flat_ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+        return self.tail[i - self.flat_count]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, word_ids):
+        self.tail.append(word_ids)
+
+    def pop(self):
+        if self.tail:
+            return self.tail.pop()
+
+        word_ids = self[self.flat_count - 1]
+        self.flat_count -= 1
+        return word_ids
+
+    # Everything as one flat array and offsets
+    def flat(self):
+        flat_ids = self.flat_ids[:self.offsets[self.flat_count]]
+        offsets = self.offsets[:self.flat_count + 1]
+
+        if not self.tail:
+            return flat_ids, offsets
+
+        tail = MessageWordIDs.from_lists(self.tail)
+        return (np.concatenate((flat_ids, tail.flat_ids)),
+                np.concatenate((offsets, tail.offsets[1:] + offsets[-1])))
+
+
+# Where each RAG message's text is, instead of the text itself, so the RAG doesn't keep yet another copy of all of
+# history in memory. A ref of 0 or more is that pair of our own chat history (counting from the first archived one, see
+# utils.history_segments), START_REF is the "Start of all history!" pair, and anything below that is a pair in the
+# imported logs (all of them back to back, in order). Reads like a list of [my message, her message]
+#
+# Each one carries its own copy of the live history (just the list, the pairs are shared) and where that started, so
+# what it reads back is always the history as of when it was made. Once it's published (see based_rag.RagView) it never
+# changes, appending or deleting makes a new one instead
+class RagHistory:
+
+    TAIL_SIZE = 256             # Refs appended since the last time they were all joined up into one array
+
+    def __init__(self, live_history, imports=None, refs=None, tail=()):
+        self.live_start, self.live = live_history
+        self.imports = []
+        self.import_starts = []
+        self.import_count = 0
+        self.refs = refs if refs is not None else np.full(1, START_REF, dtype=np.int64)
+        self.tail = tail
+
+        for file, count in imports or []:
+            self.add_import_file(file, count)
+
+    def add_import_file(self, file, count):
+        self.imports.append([file, count])
+        self.import_starts.append(self.import_count)
+        self.import_count += count
+
+    # Every pair of an imported log, onto the end (only while building it up, before it's published)
+    def add_import(self, file, count):
+        first = self.import_count
+        self.add_import_file(file, count)
+        self.extend(np.arange(-first - 2, -first - count - 2, -1, dtype=np.int64))
+
+    # A run of our own chat history, onto the end (same)
+    def add_own(self, first, count):
+        self.extend(np.arange(first, first + count, dtype=np.int64))
+
+    def extend(self, refs):
+        self.refs = np.concatenate((self.flat(), refs))
+        self.tail = ()
+
+    # A new one, with one more message, reading from the given live history
+    def appended(self, ref, live_history):
+        if len(self.tail) < self.TAIL_SIZE:
+            return RagHistory(live_history, self.imports, self.refs, self.tail + (ref,))
+
+        return RagHistory(live_history, self.imports, np.append(self.flat(), np.int64(ref)))
+
+    # A new one, for after a pair of our own history got deleted (so the ones after it moved down one)
+    def pair_deleted(self, ref, live_history):
+        refs = self.flat().copy()
+        refs[refs > ref] -= 1
+        return RagHistory(live_history, self.imports, refs)
+
+    def __len__(self):
+        return len(self.refs) + len(self.tail)
+
+    def ref(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("message index out of range")
+
+        if i < len(self.refs):
+            return int(self.refs[i])
+
+        return self.tail[i - len(self.refs)]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        ref = self.ref(i)
+        if ref == START_REF:
+            return START_PAIR
+
+        if ref >= self.live_start:
+            message_pairs = self.live[ref - self.live_start:ref - self.live_start + 1]
+        elif ref >= 0:
+            message_pairs = utils.history_segments.read_pairs(ref, ref + 1)
+        else:
+            import_ref = -ref - 2
+            file_number = bisect.bisect_right(self.import_starts, import_ref) - 1
+            position = import_ref - self.import_starts[file_number]
+            try:
+                message_pairs = utils.history_segments.read_log(self.imports[file_number][0])[position:position + 1]
+            except (OSError, ValueError):
+                message_pairs = []
+
+        # Gone (the log was moved away, or it was undone)
+        if not message_pairs:
+            return ["", ""]
+
+        return message_pairs[0][:2]
+
+    def flat(self):
+        if not self.tail:
+            return self.refs
+
+        return np.concatenate((self.refs, np.array(self.tail, dtype=np.int64)))
+
+    # The text, a run of message pairs at a time (for counting it all up again)
+    def iter_chunks(self, size):
+        for start in range(0, len(self), size):
+            yield self[start:start + size]
+
+
+def encode_strings(strings):
+    encoded = [string.encode("utf-8") for string in strings]
+    lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), np.concatenate(([0], np.cumsum(lengths)))
+
+
+def decode_strings(data, offsets):
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+# Writes the whole index out as a snapshot. Goes to a temp file first, so a crash never leaves a half-written one
+def write_snapshot(path, word_database, histories_word_id_database, history_database, generation):
+    my_ids, my_offsets = histories_word_id_database['me'].flat()
+    her_ids, her_offsets = histories_word_id_database['her'].flat()
+    word_bytes, word_offsets = encode_strings(word_database['word'])
+
+    sections = {
+        'word_bytes': word_bytes,
+        'word_offsets': word_offsets.astype(np.int64),
+        'count': np.frombuffer(word_database['count'], dtype=np.int64),
+        'me_ids': my_ids.astype(np.uint32),
+        'me_offsets': my_offsets.astype(np.int64),
+        'her_ids': her_ids.astype(np.uint32),
+        'her_offsets': her_offsets.astype(np.int64),
+        'history_refs': history_database.flat(),
+    }
+
+    header = {
+        'generation': generation,
+        'tokenizer_version': utils.rag_tokenizer.TOKENIZER_VERSION,
+        'total_word_count': word_database['total_word_count'],
+        'imports': history_database.imports,
+        'sections': {}
+    }
+
+    # Lay the arrays out one after another (8 byte aligned), after the header
+    header_size = 4096
+    while True:
+        offset = header_size
+        for name, values in sections.items():
+            header['sections'][name] = [values.dtype.str, offset, len(values)]
+            offset += (values.nbytes + 7) // 8 * 8
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        if 16 + len(header_bytes) <= header_size:
+            break
+        header_size *= 2
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(SNAPSHOT_MAGIC + struct.pack('<II', SNAPSHOT_VERSION, len(header_bytes)) + header_bytes)
+        for name, values in sections.items():
+            outfile.seek(header['sections'][name][1])
+            outfile.write(values.tobytes())
+        outfile.truncate(offset)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(temp_path, path)
+
+
+# Reads a snapshot back. Returns (word database, histories word ID database, history database, header), or None if the
+# file isn't a snapshot we can read (a newer version, or empty / cut short / damaged, so it gets rebuilt instead). The
+# header has the generation, the version, and the tokenizer version it was made with. Snapshots from before
+# HISTORY_REFS_VERSION come back with no history database, since we can't tell where their messages came from
+def read_snapshot(path, live_history):
+    try:
+        return read_snapshot_file(path, live_history)
+    except (OSError, ValueError, KeyError, TypeError, IndexError, struct.error) as e:
+        print("Issue reading the RAG snapshot, rebuilding it: " + str(e))
+        return None
+
+
+def read_snapshot_file(path, live_history):
+    with open(path, 'rb') as openfile:
+        with mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+            if snapshot[:8] != SNAPSHOT_MAGIC:
+                return None
+
+            version, header_length = struct.unpack_from('<II', snapshot, 8)
+            if version > SNAPSHOT_VERSION:
+                return None
+
+            header = json.loads(snapshot[16:16 + header_length].decode("utf-8"))
+            header['version'] = version
+            header.setdefault('tokenizer_version', 1)
+
+            # Copied out of the map, so the file is free to be replaced later
+            sections = {}
+            for name, (dtype, offset, count) in header['sections'].items():
+                sections[name] = np.frombuffer(snapshot, dtype=np.dtype(dtype), count=count, offset=offset).copy()
+
+    word_database = {
+        'word': decode_strings(sections['word_bytes'], sections['word_offsets']),
+        'count': array.array('q', sections['count'].tobytes()),
+        'total_word_count': header['total_word_count']
+    }
+
+    histories_word_id_database = {
+        'me': MessageWordIDs(sections['me_ids'], sections['me_offsets']),
+        'her': MessageWordIDs(sections['her_ids'], sections['her_offsets']),
+    }
+
+    history_database = None
+    if version >= HISTORY_REFS_VERSION:
+        history_database = RagHistory(live_history, header['imports'], sections['history_refs'])
+
+    return word_database, histories_word_id_database, history_database, header
+
+
+# The delta log starts with a line saying which snapshot it goes on top of, then one line per change
+def reset_delta_log(path, generation):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding="utf-8") as outfile:
+        outfile.write(json.dumps({'snapshot': generation}) + "\n")
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(temp_path, path)
+
+
+def append_delta_log(path, operations):
+    with open(path, 'a', encoding="utf-8") as outfile:
+        for operation in operations:
+            outfile.write(json.dumps(operation, ensure_ascii=False) + "\n")
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+
+# Changes to replay on top of the given snapshot. A half-written last line (from a crash) gets cut off, so the next
+# change goes on cleanly. Returns None if there is no log for this snapshot
+def read_delta_log(path, generation):
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'rb') as openfile:
+        lines = openfile.read().split(b"\n")
+
+    try:
+        if json.loads(lines[0]).get('snapshot') != generation:
+            return None
+    except (ValueError, AttributeError):
+        return None
+
+    operations = []
+    good_length = len(lines[0]) + 1
+    for line in lines[1:]:
+        if line.strip() == b"":
+            good_length += len(line) + 1
+            continue
+        try:
+            operations.append(json.loads(line))
+        except ValueError:
+            with open(path, 'r+b') as openfile:
+                openfile.truncate(good_length)
+            break
+        good_length += len(line) + 1
+
+    return operations
@@ -0,0 +1,69 @@
+#
+# Splits messages into words for the RAG (utils.based_rag), and counts them up for rebuilds. This is kept light (no app
+# imports), so the rebuild can run it in a pool of worker processes.
+#
+import functools
+import re
+
+import numpy as np
+
+TOKENIZER_VERSION = 2           # Saved with the RAG, so it can tell when it has to count everything up again
+
+TOKEN_CACHE_SIZE = 512          # Recent messages to keep the words of
+
+# Apostrophes and hyphens join words together ("don't" is "dont"). Any other punctuation (in any language, like curly
+# quotes, «», em-dashes) or space splits them. Letters with separate accent marks (combining marks) stay one word
+JOINERS = ("'", "\u2019", "\u02bc", "-", "\u2010", "\u00ad")
+WORD_PATTERN = re.compile(r"[^\W_]+(?:[\u0300-\u036f]+[^\W_]*)*")
+
+
+# The words in a message, in order, casefolded
+def tokenize(message):
+    message = message.casefold()
+
+    for joiner in JOINERS:
+        if joiner in message:
+            message = message.replace(joiner, "")
+
+    return WORD_PATTERN.findall(message)
+
+
+# Same, but remembers the recent ones, so a message that gets scored and then added (or redone) is only split once
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def cached_tokenize(message):
+    return tuple(tokenize(message))
+
+
+# Counts up the words in a run of message pairs, for a rebuild. Word IDs here are local to the run (in the order the
+# words first show up), and get mapped to the real ones when all the runs are merged back together, in order.
+# Returns (words, their counts, my word IDs + offsets, her word IDs + offsets, total word count)
+def count_message_pairs(message_pairs):
+    local_index = {}
+    words = []
+    counts = []
+    flat_ids = ([], [])
+    lengths = ([], [])
+
+    for message_pair in message_pairs:
+        for side in (0, 1):
+            message_words = tokenize(message_pair[side])
+
+            for word in message_words:
+                word_id = local_index.get(word)
+                if word_id is None:
+                    word_id = local_index[word] = len(words)
+                    words.append(word)
+                    counts.append(0)
+
+                counts[word_id] += 1
+                flat_ids[side].append(word_id)
+
+            lengths[side].append(len(message_words))
+
+    results = [words, np.array(counts, dtype=np.int64)]
+    for side in (0, 1):
+        results.append(np.array(flat_ids[side], dtype=np.uint32))
+        results.append(np.concatenate(([0], np.cumsum(np.array(lengths[side], dtype=np.int64)))))
+    results.append(len(flat_ids[0]) + len(flat_ids[1]))
+
+    return tuple(results)
@@ -14,6 +14,8 @@ char_name = os.environ.get("CHAR_NAME")
 
 # remembers a random past event
 def retrospect_random_mem_summary():
+    # All of history (imported logs, then ours), the same one main.py checks the length of before calling this. Only the
+    # logs we land in get read back
     history = utils.based_rag.history_database
 
     # find random point in history to think about (not including anything recently)
@@ -0,0 +1,212 @@
+#
+# Streaming transcription. While the mic is still recording, the audio is cut into segments where you stop talking and
+# each one is sent to Whisper in a worker thread. Once the mic is released, only the last little bit is left to do.
+#
+# Where to cut comes from the VAD (utils.vad), the same speech-end events autochat goes by, so there's just the one idea
+# of when someone stopped talking.
+#
+import os
+import queue
+import re
+import threading
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import utils.audio
+import utils.cane_lib
+import utils.custom_logging
+import utils.mic_capture
+import utils.transcriber_translate
+import utils.vad
+
+# Needs the in-memory recording path, as the segments are passed to Whisper as arrays
+WHISPER_STREAMING = os.environ.get("WHISPER_STREAMING") == "ON" and os.environ.get("RECORD_TO_MEMORY") == "ON"
+
+MIN_SEGMENT_SECONDS = 2.5       # Don't bother cutting anything shorter than this, Whisper does worse on tiny bits
+MAX_SEGMENT_SECONDS = 20.0      # Past this, cut at the next little gap in the talking, instead of waiting for it to end
+
+SPEECH_START = "Speech Start"
+SPEECH_END = "Speech End"
+
+stream_active = False
+stream_queue = None
+stream_thread = None
+stream_cancelled = None
+stream_segments = []
+
+vad_hooked = False
+
+
+# Starts streaming a recording. start_position is where in the mic capture the first audio fed in is from
+def start_stream(rate, start_position):
+    global stream_active, stream_queue, stream_thread, stream_cancelled, stream_segments, vad_hooked
+
+    if not vad_hooked:
+        utils.vad.add_speech_start_listener(on_speech_start)
+        utils.vad.add_speech_end_listener(on_speech_end)
+        vad_hooked = True
+
+    stream_segments = []
+    stream_queue = queue.Queue()
+    stream_cancelled = threading.Event()
+    stream_active = True
+
+    stream_thread = threading.Thread(target=stream_worker, args=(stream_queue, rate, start_position, stream_cancelled, stream_segments))
+    stream_thread.daemon = True
+    stream_thread.start()
+
+
+# Feed in raw 16-bit PCM, as it comes off the mic
+def feed_frames(data):
+    if stream_active:
+        stream_queue.put(data)
+
+
+# From the VAD (on the mic capture thread), just note down where it happened
+def on_speech_start():
+    if stream_active:
+        stream_queue.put((SPEECH_START, utils.mic_capture.get_position()))
+
+
+def on_speech_end():
+    if stream_active:
+        stream_queue.put((SPEECH_END, utils.mic_capture.get_position()))
+
+
+# Ends the stream, waits for the last segment, and returns the stitched transcript
+def finish_stream():
+    global stream_active
+
+    if not stream_active:
+        return ""
+
+    stream_active = False
+    stream_queue.put(None)
+    stream_thread.join()
+
+    transcript = ""
+    for segment in stream_segments:
+        transcript = stitch_segment(transcript, segment)
+
+    return transcript
+
+
+# Throw away a stream we don't want anymore (such as autochat picking up a random noise, or the recording breaking).
+# With wait, also waits for the worker to be done (it finishes off whatever segment it is on first)
+def cancel_stream(wait=False):
+    global stream_active
+
+    if not stream_active:
+        return
+
+    stream_active = False
+    stream_cancelled.set()
+    stream_queue.put(False)
+
+    if wait:
+        stream_thread.join()
+
+
+# Gets the transcript for a finished recording, using the stream if there was one running
+def finish_transcription(recording):
+    if stream_active:
+        return finish_stream()
+
+    return utils.transcriber_translate.to_transcribe_original_language(recording)
+
+
+def stream_worker(frame_queue, rate, start_position, cancelled, segments):
+    pending = bytearray()
+    pending_start = start_position          # Where in the mic capture the pending audio starts
+    last_speech_start = start_position      # (the start of the recording counts, that's the pre-roll of us talking)
+    speech_ends = []                        # Cuts the VAD gave us, that the recording hasn't caught up to yet
+
+    # The VAD says talking ended once it's been quiet for a while, so cut in the middle of that quiet
+    end_offset = utils.vad.TRAILING_SILENCE_MS * rate // 2000
+    min_bytes = int(MIN_SEGMENT_SECONDS * rate) * 2
+    max_bytes = int(MAX_SEGMENT_SECONDS * rate) * 2
+
+    while True:
+        item = frame_queue.get()
+
+        # Cancelled, drop everything
+        if item is False or cancelled.is_set():
+            return
+
+        # Finished, transcribe whatever is left (if there was any talking in it)
+        if item is None:
+            if last_speech_start >= pending_start or utils.vad.is_speaking():
+                transcribe_segment(pending, rate, segments)
+            return
+
+        if isinstance(item, tuple):
+            event, position = item
+            if event == SPEECH_START:
+                last_speech_start = position
+            else:
+                speech_ends.append(position - end_offset)
+            continue
+
+        pending += item
+        pending_end = pending_start + len(pending) // 2
+
+        cut_point = 0
+        while speech_ends and speech_ends[0] <= pending_end:
+            cut_bytes = (speech_ends.pop(0) - pending_start) * 2
+            if cut_bytes >= min_bytes:
+                cut_point = cut_bytes
+
+        # No end in sight, so take the next short gap (still talking, but the VAD is waiting to see if it's the end)
+        if cut_point == 0 and len(pending) >= max_bytes and utils.vad.vad_state == utils.vad.HANGOVER:
+            cut_point = len(pending)
+            last_speech_start = pending_end
+
+        if cut_point > 0:
+            transcribe_segment(pending[:cut_point], rate, segments)
+            del pending[:cut_point]
+            pending_start += cut_point // 2
+
+
+def transcribe_segment(segment_bytes, rate, segments):
+    if len(segment_bytes) < 2:
+        return
+
+    try:
+        segment_audio = utils.audio.frames_to_whisper_array([bytes(segment_bytes)], rate)
+        segment_text = utils.transcriber_translate.to_transcribe_original_language(segment_audio)
+
+        # Fix any accidental repeats within the segment itself (whisper glitch)
+        segments.append(utils.cane_lib.remove_repeats(segment_text))
+
+    except Exception as e:
+        utils.custom_logging.update_debug_log("Issue transcribing a streamed segment: " + str(e))
+
+
+# Joins on the next segment, dropping any words it repeats from the end of the previous one
+def stitch_segment(transcript, segment):
+    segment = segment.strip()
+    if segment == "":
+        return transcript
+    if transcript == "":
+        return segment
+
+    previous_words = transcript.split()
+    new_words = segment.split()
+
+    overlap = min(len(previous_words), len(new_words), 8)
+    while overlap > 1:
+        if [normalize_word(w) for w in previous_words[-overlap:]] == [normalize_word(w) for w in new_words[:overlap]]:
+            utils.custom_logging.update_debug_log("Removed overlap between streamed segments: " + " ".join(new_words[:overlap]))
+            new_words = new_words[overlap:]
+            break
+        overlap -= 1
+
+    if len(new_words) == 0:
+        return transcript
+
+    return transcript + " " + " ".join(new_words)
+
+
+def normalize_word(word):
+    return re.sub(r'[^\w]', '', word.lower())
@@ -1,22 +1,128 @@
 import os
+import threading
+import time
 
-import whisper
-import torch
+import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+import utils.asr_backends
+import utils.custom_logging
 
 USER_MODEL = os.environ.get("WHISPER_MODEL")
+USER_BACKEND = os.environ.get("WHISPER_BACKEND", utils.asr_backends.WhisperBackend.name)
+
+# Process-wide model cache. Loaded once (ideally at boot, via the warm-up) and reused for every turn
+loaded_model = None
+loaded_model_name = ""
+model_lock = threading.Lock()
+decode_lock = threading.Lock()
+
+# Timings, for the debug log and the web UI
+last_load_time = 0.0
+last_warmup_time = 0.0
+last_decode_time = 0.0
+
+
+def load_model(model_name=None):
+    global loaded_model, loaded_model_name, last_load_time
+
+    if model_name is None:
+        model_name = USER_MODEL
+
+    with model_lock:
+
+        # Already in memory, nothing to do
+        if loaded_model is not None and loaded_model_name == model_name:
+            return loaded_model
+
+        # Drop the old one first, so we never hold two models in memory at once
+        if loaded_model is not None:
+            loaded_model.unload()
+        loaded_model = None
+        loaded_model_name = ""
+
+        load_start = time.perf_counter()
+        backend = utils.asr_backends.create_backend(USER_BACKEND, model_name)
+        backend.load()
+        loaded_model = backend
+        loaded_model_name = model_name
+        last_load_time = time.perf_counter() - load_start
+
+    utils.custom_logging.update_debug_log("Whisper model '" + model_name + "' (" + backend.name + ", " + backend.device + ", "
+                                          + backend.compute_type + ") loaded in " + "{:.2f}".format(last_load_time) + "s")
+
+    return backend
+
+
+def unload_model():
+    global loaded_model, loaded_model_name
+
+    with model_lock:
+        if loaded_model is not None:
+            loaded_model.unload()
+        loaded_model = None
+        loaded_model_name = ""
+
+    utils.custom_logging.update_debug_log("Whisper model unloaded!")
+
+
+# Swap to another model at runtime (from the web UI). It is loaded right away, so the next turn doesn't pay for it
+def switch_model(model_name):
+    global USER_MODEL
+
+    model_name = model_name.strip()
+    if model_name == "":
+        return
+
+    USER_MODEL = model_name
+    load_model(model_name)
+
+
+# Loads the model and runs a throwaway decode, so that the first real turn doesn't pay the setup costs. Run this in a thread!
+def warm_up():
+    global last_warmup_time
+
+    try:
+        model = load_model()
+
+        warmup_start = time.perf_counter()
+        with decode_lock:
+            model.transcribe(np.zeros(utils.asr_backends.SAMPLE_RATE, dtype=np.float32), language="en")
+        last_warmup_time = time.perf_counter() - warmup_start
+
+        utils.custom_logging.update_debug_log("Whisper warm-up decode took " + "{:.2f}".format(last_warmup_time) + "s")
+
+    except Exception as e:
+        print("Issue warming up the Whisper model: " + str(e))
+        utils.custom_logging.update_debug_log("Issue warming up the Whisper model: " + str(e))
+
+
+def get_model_status():
+    model = loaded_model
+    if model is None:
+        return "No model loaded"
+
+    return (loaded_model_name + " (" + model.name + ", " + model.device + ", " + model.compute_type + ")"
+            + " | load " + "{:.2f}".format(last_load_time) + "s"
+            + " | warm-up " + "{:.2f}".format(last_warmup_time) + "s"
+            + " | last decode " + "{:.2f}".format(last_decode_time) + "s")
+
 
 def to_transcribe_original_language(voice):
+    global last_decode_time
 
     nresult=""
-    model = whisper.load_model(USER_MODEL)
-    result = model.transcribe(voice, language="en", compression_ratio_threshold=1.9, no_speech_threshold=0.1)
-    for mem in result["segments"]:
-        nresult+=mem['text']+" "
+    model = load_model()
 
-    return nresult
+    decode_start = time.perf_counter()
+    with decode_lock:
+        segments = model.transcribe(voice, language="en")
+    last_decode_time = time.perf_counter() - decode_start
 
+    utils.custom_logging.update_debug_log("Whisper decode took " + "{:.2f}".format(last_decode_time) + "s")
 
+    for text in segments:
+        nresult+=text+" "
+
+    return nresult
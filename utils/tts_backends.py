@@ -0,0 +1,100 @@
+#
+# Text to speech backends. Each one renders a sentence into raw PCM audio, which then goes out through the playback in
+# utils.audio. Pick one with TTS_ENGINE in the .env; like the Whisper backends, the imports only happen for the one in use.
+#
+#   "sapi"       - Windows' built-in voices (SAPI). The original
+#   "espeak-ng"  - eSpeak NG, for Linux (and anywhere else it is installed)
+#   "stub"       - Renders silence, for testing without a voice
+#   "auto"       - SAPI on Windows, eSpeak NG everywhere else
+#
+import io
+import os
+import shutil
+import subprocess
+import wave
+
+
+class SapiBackend:
+
+    name = "sapi"
+
+    SAFT22kHz16BitMono = 22
+
+    def __init__(self):
+        self.speaker = None
+        self.audio_format = None
+
+    # Has to be called from the thread that will do the rendering, COM objects stay on the thread they were made on
+    def load(self):
+        import pythoncom
+        import win32com.client
+
+        pythoncom.CoInitialize()
+        self.speaker = win32com.client.Dispatch("SAPI.SpVoice")
+        self.audio_format = win32com.client.Dispatch("SAPI.SpAudioFormat")
+        self.audio_format.Type = self.SAFT22kHz16BitMono
+
+    # Returns (pcm bytes, sample width, channels, rate)
+    def render(self, sentence):
+        import win32com.client
+
+        memory_stream = win32com.client.Dispatch("SAPI.SpMemoryStream")
+        memory_stream.Format = self.audio_format
+        self.speaker.AudioOutputStream = memory_stream
+        self.speaker.Speak(sentence)
+
+        return bytes(memory_stream.GetData()), 2, 1, 22050
+
+
+class EspeakBackend:
+
+    name = "espeak-ng"
+
+    def __init__(self):
+        self.command = None
+
+    def load(self):
+        self.command = shutil.which("espeak-ng") or shutil.which("espeak")
+        if self.command is None:
+            raise RuntimeError("espeak-ng was not found, install it (e.g. 'apt install espeak-ng') or pick another TTS_ENGINE")
+
+    def render(self, sentence):
+        result = subprocess.run([self.command, "--stdout", sentence], capture_output=True, check=True)
+
+        with wave.open(io.BytesIO(result.stdout), 'rb') as wav_file:
+            return (wav_file.readframes(wav_file.getnframes()), wav_file.getsampwidth(),
+                    wav_file.getnchannels(), wav_file.getframerate())
+
+
+class StubBackend:
+
+    name = "stub"
+
+    def load(self):
+        pass
+
+    # A little bit of silence per word, so timing still works out
+    def render(self, sentence):
+        frames = 1102 * max(1, len(sentence.split()))
+        return bytes(frames * 2), 2, 1, 22050
+
+
+BACKENDS = {
+    SapiBackend.name: SapiBackend,
+    EspeakBackend.name: EspeakBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def create_backend(backend_name):
+    backend_name = str(backend_name).strip().lower()
+    default_name = SapiBackend.name if os.name == "nt" else EspeakBackend.name
+
+    if backend_name == "auto":
+        backend_name = default_name
+
+    if backend_name not in BACKENDS:
+        print("Unknown TTS engine '" + backend_name + "', using '" + default_name + "' instead!")
+        backend_name = default_name
+
+    return BACKENDS[backend_name]()
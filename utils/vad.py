@@ -0,0 +1,158 @@
+#
+# Voice activity detection, for autochat. Looks at every 10ms frame of mic audio and decides if it is speech, using
+# the frame energy, the zero-crossing rate and the spectral flatness (speech is "peaky", noise/hiss is flat).
+# A small state machine (silence -> onset -> speech -> hangover) turns that into speech-start and speech-end events.
+#
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+import utils.mic_capture
+
+RATE = utils.mic_capture.RATE
+FRAME_SAMPLES = RATE // 100                 # 10ms frames
+
+ONSET_MS = 60                               # Speech needed before we call it the start of talking
+TRAILING_SILENCE_MS = int(os.environ.get("VAD_TRAILING_SILENCE_MS", "800"))    # Silence needed before we call it the end
+
+FLATNESS_LIMIT = 0.45                       # Frames flatter than this are noise-like...
+ZCR_LIMIT = 0.25                            # ...and if they cross zero this often too, they're not speech (fans, hiss, clicks)
+
+SILENCE = "Silence"
+ONSET = "Onset"
+SPEECH = "Speech"
+HANGOVER = "Hangover"
+
+vad_state = SILENCE
+onset_frames = 0
+silence_frames = 0
+
+# Sensitivity uses the same scale as the old volume listener (4 - 144, higher needs louder speech)
+threshold_db = -24.0
+latest_level_db = -100.0
+
+carry = np.zeros(0, dtype=np.float32)
+window = np.hanning(FRAME_SAMPLES).astype(np.float32)
+state_lock = threading.Lock()
+
+speech_start_listeners = []
+speech_end_listeners = []
+
+
+def set_sensitivity(sensitivity):
+    global threshold_db
+
+    # Old listener level was roughly 320 * RMS, so this keeps the slider meaning the same thing
+    threshold_db = float(20 * np.log10(max(sensitivity, 1) / 320))
+
+
+def add_speech_start_listener(listener):
+    speech_start_listeners.append(listener)
+
+
+def add_speech_end_listener(listener):
+    speech_end_listeners.append(listener)
+
+
+def is_speaking():
+    return vad_state == SPEECH or vad_state == HANGOVER
+
+
+def get_level_db():
+    return latest_level_db
+
+
+# Drops back to silence, without sending any events (used when she finishes talking, so we don't pick up on her)
+def reset():
+    global vad_state, onset_frames, silence_frames
+
+    with state_lock:
+        vad_state = SILENCE
+        onset_frames = 0
+        silence_frames = 0
+
+
+# Works out which frames are speech, all at once
+def classify_frames(frames):
+    global latest_level_db
+
+    power = np.mean(frames ** 2, axis=1)
+    energy_db = 10 * np.log10(power + 1e-10)
+
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / FRAME_SAMPLES
+
+    spectrum = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+    flatness = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+
+    latest_level_db = float(energy_db[-1])
+
+    noise_like = (flatness > FLATNESS_LIMIT) & (zcr > ZCR_LIMIT)
+    return (energy_db > threshold_db) & ~noise_like
+
+
+# Feed in blocks of int16 mic audio (hooked into the shared mic capture)
+def process_block(block):
+    global carry
+
+    samples = np.concatenate((carry, block.astype(np.float32) / 32768.0))
+    frame_count = len(samples) // FRAME_SAMPLES
+    carry = samples[frame_count * FRAME_SAMPLES:]
+
+    if frame_count == 0:
+        return
+
+    speech_frames = classify_frames(samples[:frame_count * FRAME_SAMPLES].reshape(frame_count, FRAME_SAMPLES))
+
+    for is_speech in speech_frames:
+        step_state(is_speech)
+
+
+def step_state(is_speech):
+    global vad_state, onset_frames, silence_frames
+
+    event = None
+
+    with state_lock:
+        if vad_state == SILENCE or vad_state == ONSET:
+            if is_speech:
+                onset_frames += 1
+                vad_state = ONSET
+            else:
+                onset_frames = max(0, onset_frames - 1)
+                if onset_frames == 0:
+                    vad_state = SILENCE
+
+            if onset_frames * 10 >= ONSET_MS:
+                vad_state = SPEECH
+                silence_frames = 0
+                event = speech_start_listeners
+
+        else:
+            if is_speech:
+                vad_state = SPEECH
+                silence_frames = 0
+            else:
+                vad_state = HANGOVER
+                silence_frames += 1
+
+                if silence_frames * 10 >= TRAILING_SILENCE_MS:
+                    vad_state = SILENCE
+                    onset_frames = 0
+                    event = speech_end_listeners
+
+    if event is not None:
+        for listener in event:
+            listener()
+
+
+# Hooks the VAD into the shared mic capture
+def start_vad():
+
+    if utils.mic_capture.no_mic:
+        return
+
+    utils.mic_capture.add_block_listener(process_block)
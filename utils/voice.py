@@ -1,45 +1,159 @@
 #
 # Script is for the TTS, since it is now going to be threaded
 #
+# Lines get split into sentences and put on a queue, and a speech worker thread reads them out one by one. That way
+# whoever is queueing (like the LLM stream) can keep going while she talks.
+#
+# The worker renders each sentence to audio with the TTS engine (see utils.tts_backends), and hands it to the playback
+# queue in utils.audio. It renders the next sentence while the current one is playing, so there are no gaps between them.
+#
+import collections
+import os
+import queue
+import threading
 import time
 
-import win32com.client
+from dotenv import load_dotenv
+load_dotenv()
+
+import utils.audio
 import utils.hotkeys
+import utils.tts_backends
 import utils.voice_splitter
 
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "auto")
+
+SPEECH_QUEUE_SIZE = 32          # Sentences waiting to be spoken, before queueing more has to wait
+
 is_speaking = False
-cut_voice = False
 
-def speak_line(s_message, refuse_pause):
+speech_queue = queue.Queue(maxsize=SPEECH_QUEUE_SIZE)
+speech_thread = None
+speech_lock = threading.Lock()
+pending_sentences = 0           # Queued, plus the ones rendering/playing right now
+speech_generation = 0           # Bumped when we cut the voice, so anything older gets skipped
 
-    global cut_voice
-    cut_voice = False
 
-    chunky_message = utils.voice_splitter.split_into_sentences(s_message)
+def start_speech_worker():
+    global speech_thread
 
-    for chunk in chunky_message:
-        speaker = win32com.client.Dispatch("SAPI.SpVoice")
-        speaker.Speak(chunk)
+    with speech_lock:
+        if speech_thread is None:
+            speech_thread = threading.Thread(target=speech_worker)
+            speech_thread.daemon = True
+            speech_thread.start()
+
+
+def speech_worker():
+
+    # Loaded on this thread, some engines (SAPI) only work on the thread they were made on
+    tts_engine = utils.tts_backends.create_backend(TTS_ENGINE)
+
+    # If it can't load (like espeak-ng not being installed), keep going on the stub, so nobody waiting on speech gets stuck
+    try:
+        tts_engine.load()
+    except Exception as e:
+        print("Issue loading the '" + tts_engine.name + "' TTS engine, speaking silently instead: " + str(e))
+        tts_engine = utils.tts_backends.StubBackend()
+        tts_engine.load()
+
+    # Finished-playing events for the sentences we have handed off to playback, oldest first
+    playing = collections.deque()
+
+    while True:
+
+        # Break free if we undo/redo, and stop reading (checked every pass, so the last sentences can be cut too)
+        check_cut_pressed(playing)
+
+        # Let go of any sentences that are done playing
+        while playing and playing[0].is_set():
+            playing.popleft()
+            finish_sentence()
+
+        try:
+            sentence, generation = speech_queue.get(timeout=0.01 if playing else None)
+        except queue.Empty:
+            continue
+
+        # Only render one sentence ahead of the one that is playing
+        while len(playing) > 1:
+            check_cut_pressed(playing)
+            if playing[0].wait(timeout=0.01):
+                playing.popleft()
+                finish_sentence()
+
+        if generation != speech_generation:
+            finish_sentence()
+            continue
+
+        try:
+            pcm, sample_width, channels, rate = tts_engine.render(sentence)
+        except Exception as e:
+            print("Issue with the TTS engine: " + str(e))
+            finish_sentence()
+            continue
 
-        if not refuse_pause:
-            time.sleep(0.05)    # IMPORTANT: Mini-rests between chunks for other calculations in the program to run.
-        else:
-            time.sleep(0.001)   # Still have a mini-mini rest, even with pauses
+        # Cut while we were rendering
+        if generation != speech_generation:
+            finish_sentence()
+            continue
 
-        # Break free if we undo/redo, and stop reading
-        if utils.hotkeys.NEXT_PRESSED or utils.hotkeys.REDO_PRESSED or cut_voice:
-            cut_voice = False
-            break
+        playing.append(utils.audio.queue_pcm(pcm, sample_width, channels, rate))
 
 
+# Cuts the voice if next/redo got pressed while she's still got something to say
+def check_cut_pressed(playing):
+    if not (utils.hotkeys.NEXT_PRESSED or utils.hotkeys.REDO_PRESSED):
+        return
 
+    if playing or check_if_speaking():
+        force_cut_voice()
 
-    # Reset the volume cooldown so she don't pickup on herself
-    utils.hotkeys.cooldown_listener_timer()
 
-    set_speaking(False)
+def finish_sentence():
+    global pending_sentences
+
+    with speech_lock:
+        pending_sentences -= 1
+        if pending_sentences > 0:
+            return
+
+        pending_sentences = 0
+
+        # Reset the volume cooldown so she don't pickup on herself
+        utils.hotkeys.cooldown_listener_timer()
+
+        set_speaking(False)
+
+
+# Queues up a line to be spoken, and returns right away. (refuse_pause is left over from when speaking held up the
+# whole program and needed rests between sentences, it isn't needed anymore)
+def queue_line(s_message, refuse_pause):
+    global pending_sentences
+
+    start_speech_worker()
+
+    chunky_message = utils.voice_splitter.split_into_sentences(s_message)
+    generation = speech_generation
+
+    for chunk in chunky_message:
+        with speech_lock:
+            pending_sentences += 1
+            set_speaking(True)
+
+        speech_queue.put((chunk, generation))
+
+
+# Speaks a line, and waits for it (and anything queued before it) to finish
+def speak_line(s_message, refuse_pause):
+    queue_line(s_message, refuse_pause)
+    wait_for_speech()
+
+
+def wait_for_speech():
+    while check_if_speaking():
+        time.sleep(0.01)
 
-    return
 
 # Midspeaking (still processing whole message)
 def check_if_speaking():
@@ -49,6 +163,16 @@ def set_speaking(set):
     global is_speaking
     is_speaking = set
 
+# Stops talking right away, and throws out everything queued up
 def force_cut_voice():
-    global cut_voice
-    cut_voice = True
+    global speech_generation
+
+    speech_generation += 1
+    utils.audio.stop_playback()
+
+    try:
+        while True:
+            speech_queue.get_nowait()
+            finish_sentence()
+    except queue.Empty:
+        pass
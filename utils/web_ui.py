@@ -5,10 +5,12 @@ import gradio as gr
 import main
 import API.Oogabooga_Api_Support
 import utils.custom_logging
+import utils.history_sqlite
 import utils.settings
 import utils.hotkeys
 import utils.tag_task_controller
 import utils.voice
+import utils.transcriber_translate
 import utils.i18n
 import json
 
@@ -505,6 +507,41 @@ with gr.Blocks(theme=based_theme, title=_("app_title")) as demo:
             model_preset_button.click(fn=model_preset_button_click, inputs=model_preset_textbox)
 
 
+        #
+        # Whisper Model
+        #
+
+        def whisper_model_button_click(input_text):
+
+            print("\nSwitching Whisper model to " + input_text + "...\n")
+            utils.transcriber_translate.switch_model(input_text)
+
+            return
+
+        def whisper_unload_button_click():
+
+            utils.transcriber_translate.unload_model()
+
+            return
+
+
+        with gr.Row():
+            whisper_model_textbox = gr.Textbox(value=utils.transcriber_translate.USER_MODEL, label=_("textboxes.whisper_model"))
+
+            whisper_model_button = gr.Button(value=_("buttons.change_whisper_model"))
+            whisper_model_button.click(fn=whisper_model_button_click, inputs=whisper_model_textbox)
+
+            whisper_unload_button = gr.Button(value=_("buttons.unload_whisper_model"))
+            whisper_unload_button.click(fn=whisper_unload_button_click)
+
+        whisper_status_box = gr.Textbox(label=_("textboxes.whisper_status"))
+
+        def update_whisper_view():
+            return utils.transcriber_translate.get_model_status()
+
+        demo.load(update_whisper_view, every=0.05, outputs=[whisper_status_box])
+
+
 
 
         def update_settings_view():
@@ -623,6 +660,49 @@ with gr.Blocks(theme=based_theme, title=_("app_title")) as demo:
 
         demo.load(update_logs, every=0.05, outputs=[debug_log, rag_log, kelvin_log])
 
+        #
+        # History Search (from the SQLite history, when it's on)
+
+        def history_results_text(message_pairs):
+            search_results = ""
+            for message_pair in message_pairs:
+                if message_pair[3] is not None:
+                    search_results += "[" + message_pair[3] + "]\n"
+                search_results += "You: " + message_pair[0] + "\n"
+                search_results += utils.settings.char_name + ": " + message_pair[1] + "\n\n"
+
+            return search_results
+
+        def search_history_button_click(query):
+            return history_results_text(utils.history_sqlite.search(query, limit=20))
+
+        def search_tag_button_click(tag):
+            return history_results_text(utils.history_sqlite.pairs_tagged(tag.strip(), limit=20))
+
+        # Dates as "YYYY-MM-DD" (or with a time too), up to and including the end one
+        def search_dates_button_click(start, end):
+            return history_results_text(utils.history_sqlite.pairs_between(start.strip(), end.strip() + "\uffff", limit=20))
+
+        if utils.history_sqlite.enabled:
+
+            with gr.Row():
+                search_history_box = gr.Textbox(label=_("textboxes.search_history"))
+                search_history_button = gr.Button(value=_("buttons.search_history"))
+
+            with gr.Row():
+                search_tag_box = gr.Textbox(label=_("textboxes.search_tag"))
+                search_tag_button = gr.Button(value=_("buttons.search_tag"))
+
+            with gr.Row():
+                search_from_box = gr.Textbox(label=_("textboxes.search_from"))
+                search_to_box = gr.Textbox(label=_("textboxes.search_to"))
+                search_dates_button = gr.Button(value=_("buttons.search_dates"))
+
+            search_results_box = gr.Textbox(lines=10, label=_("textboxes.search_results"))
+            search_history_button.click(fn=search_history_button_click, inputs=search_history_box, outputs=search_results_box)
+            search_tag_button.click(fn=search_tag_button_click, inputs=search_tag_box, outputs=search_results_box)
+            search_dates_button.click(fn=search_dates_button_click, inputs=[search_from_box, search_to_box], outputs=search_results_box)
+
 
 
     #